@@ -0,0 +1,308 @@
+"""In-process stand-ins for the Discord objects the cogs touch.
+
+They implement just enough of the discord.py surface for the relay, close
+and export paths, record what was sent, and can add a fixed delay to every
+REST-like call to model API round trips.
+"""
+import asyncio
+import collections
+import itertools
+import random
+import time
+
+import discord
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id():
+    return next(_ids)
+
+
+class _ErrorResponse:
+    # The parts of an aiohttp response discord.HTTPException reads
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+def check_embed(embed):
+    """Reject an embed over Discord's size limits with a 400, as the API does."""
+    if embed is None:
+        return
+    too_large = (
+        len(embed) > 6000
+        or len(embed.fields) > 25
+        or len(embed.description or "") > 4096
+        or any(len(field.name) > 256 or len(field.value) > 1024 for field in embed.fields)
+    )
+    if too_large:
+        raise discord.HTTPException(_ErrorResponse(400, "Bad Request"), "Invalid Form Body: embed exceeds size limits")
+
+
+class Latency:
+    """Simulated REST round trip added to every send/edit/create call."""
+
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+
+    async def wait(self):
+        if self.seconds:
+            await asyncio.sleep(self.seconds)
+        else:
+            await asyncio.sleep(0)
+
+
+class Recorder:
+    """Notes when each tracked message has been delivered.
+
+    Tracked messages carry a token in their content; a send whose embed
+    description contains that token completes it.
+    """
+
+    def __init__(self):
+        self.started = {}
+        self.latencies = collections.defaultdict(list)
+        self.sent = 0
+
+    def start(self, token, direction):
+        self.started[token] = (time.perf_counter(), direction)
+
+    def delivered(self, embed):
+        self.sent += 1
+        if embed is None or not embed.description:
+            return
+        token = embed.description.split(" ", 1)[0]
+        started = self.started.pop(token, None)
+        if started is not None:
+            started_at, direction = started
+            self.latencies[direction].append(time.perf_counter() - started_at)
+
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeUser:
+    def __init__(self, name, network, recorder, user_id=None):
+        self.id = user_id or next_id()
+        self.name = name
+        self.discriminator = "0"
+        self.bot = False
+        self.avatar = None
+        self.default_avatar = FakeAsset()
+        self.mention = f"<@{self.id}>"
+        self.dm_channel = FakeDMChannel(self)
+        self._network = network
+        self._recorder = recorder
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, *, embed=None, files=None, **kwargs):
+        await self._network.wait()
+        check_embed(embed)
+        self._recorder.delivered(embed)
+        return FakeMessage(None, self.dm_channel, content)
+
+
+class FakeMember(FakeUser):
+    def __init__(self, name, network, recorder, guild, roles):
+        super().__init__(name, network, recorder)
+        self.guild = guild
+        self.roles = roles
+
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+
+
+class FakeDMChannel(discord.DMChannel):
+    def __init__(self, recipient):
+        self.id = next_id()
+        self.recipient = recipient
+        self.me = None
+
+
+class FakeTextChannel:
+    def __init__(self, guild, name, category=None, topic=None):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.topic = topic
+        self.category_id = category.id if category else None
+        self.mention = f"<#{self.id}>"
+        self.messages = 0
+
+    async def send(self, content=None, *, embed=None, files=None, view=None, delete_after=None, **kwargs):
+        await self.guild.network.wait()
+        check_embed(embed)
+        self.messages += 1
+        self.guild.recorder.delivered(embed)
+        return FakeMessage(self.guild.me, self, content, guild=self.guild)
+
+    async def edit(self, **fields):
+        await self.guild.network.wait()
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    async def delete(self, reason=None):
+        await self.guild.network.wait()
+        self.guild.channels.pop(self.id, None)
+
+
+class FakeCategory:
+    def __init__(self, guild, name):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+
+
+class FakeGuild:
+    # Upload limit of an unboosted guild
+    filesize_limit = 25 * 1024 * 1024
+
+    def __init__(self, network, recorder):
+        self.id = next_id()
+        self.name = "Benchmark Guild"
+        self.network = network
+        self.recorder = recorder
+        self.channels = {}
+        self.category = FakeCategory(self, "ModMail")
+        self.channels[self.category.id] = self.category
+        self.default_role = FakeRole(self.id)
+        self.me = FakeUser("ModMail", network, recorder)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def create_text_channel(self, name, category=None, topic=None, **kwargs):
+        await self.network.wait()
+        channel = FakeTextChannel(self, name, category, topic)
+        self.channels[channel.id] = channel
+        return channel
+
+
+class FakeAttachment:
+    def __init__(self, filename, size, spoiler=False):
+        self.id = next_id()
+        self.filename = f"SPOILER_{filename}" if spoiler else filename
+        self.size = size
+        # Signed CDN links carry expiry and signature parameters
+        self.url = (
+            f"https://cdn.discordapp.com/attachments/{next_id()}/{self.id}/{filename}"
+            f"?ex={self.id % 2 ** 32:08x}&is={self.id % 2 ** 31:08x}&hm={self.id:064x}&"
+        )
+        self.description = None
+
+    def is_spoiler(self):
+        return self.filename.startswith("SPOILER_")
+
+
+class FakeMessage:
+    def __init__(self, author, channel, content, guild=None, attachments=()):
+        self.id = next_id()
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.content = content or ""
+        self.attachments = list(attachments)
+        self.created_at = discord.utils.utcnow()
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def delete(self):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, network):
+        self._network = network
+        self.files = 0
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def defer(self, *, ephemeral=False, thinking=False):
+        await self._network.wait()
+        self.done = True
+
+    async def send_message(self, content=None, *, embed=None, files=None, ephemeral=False, **kwargs):
+        await self._network.wait()
+        self.files += len(files or [])
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        await self._network.wait()
+
+
+class FakeInteraction:
+    def __init__(self, user, channel, network):
+        self.user = user
+        self.channel = channel
+        self.response = FakeResponse(network)
+        self.followup = self
+
+    async def send(self, content=None, *, files=None, ephemeral=False, **kwargs):
+        await self.response.send_message(content, files=files, ephemeral=ephemeral)
+
+
+class FakeContent:
+    def __init__(self, data):
+        self._data = data
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._data), size):
+            yield self._data[start:start + size]
+
+
+class FakeResponseBody:
+    def __init__(self, data):
+        self.content = FakeContent(data)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """Serves attachment downloads from memory in place of aiohttp.
+
+    Attachment bytes are generated when they are downloaded, so attachments
+    relayed as links never take up memory.
+    """
+
+    closed = False
+
+    def __init__(self, network):
+        self._network = network
+        self.blobs = {}
+        self.requests = 0
+
+    def add(self, attachment):
+        self.blobs[attachment.url] = attachment.size
+
+    def get(self, url):
+        self.requests += 1
+        data = random.Random(url).randbytes(self.blobs[url])
+        return _Delayed(self._network, FakeResponseBody(data))
+
+    async def close(self):
+        pass
+
+
+class _Delayed:
+    # Adds the simulated round trip before the response body is available
+    def __init__(self, network, body):
+        self._network = network
+        self._body = body
+
+    async def __aenter__(self):
+        await self._network.wait()
+        return self._body
+
+    async def __aexit__(self, *exc):
+        return False
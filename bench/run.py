@@ -0,0 +1,309 @@
+"""Offline throughput benchmark for the ModMail cogs.
+
+Drives ``ModMail.on_message`` (and through it ``create_thread``,
+``forward_to_thread`` and ``forward_to_user``), ``ModMail.close_thread`` and
+``Utils.export_thread`` against the in-process fakes in :mod:`bench.fakes`.
+No token or network access is needed; state is written to a temporary
+directory that is removed afterwards.
+
+Run from the repository root:
+
+    python -m bench.run --users 200 --messages 20 --attachment-ratio 0.1
+
+Messages that carry more attachments than fit in one upload, e.g. ten
+files at the 25 MiB limit, check that the overflow is relayed as links:
+
+    python -m bench.run --users 5 --messages 2 --attachment-ratio 1 --attachments-per-message 10 --attachment-kb 25600
+
+Prints messages/sec, p50/p99 latencies and peak memory, or a JSON report
+with ``--json`` for comparing runs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.fakes import (
+    FakeAttachment,
+    FakeGuild,
+    FakeInteraction,
+    FakeMember,
+    FakeMessage,
+    FakeRole,
+    FakeSession,
+    FakeUser,
+    Latency,
+    Recorder
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ModMail throughput benchmark")
+    parser.add_argument("--users", type=int, default=100, help="users opening a thread")
+    parser.add_argument("--messages", type=int, default=10, help="messages per user after the first, each answered by staff")
+    parser.add_argument("--attachment-ratio", type=float, default=0.1, help="share of messages carrying an attachment")
+    parser.add_argument("--attachment-kb", type=int, default=256, help="attachment size in KiB")
+    parser.add_argument("--attachments-per-message", type=int, default=1, help="attachments on each message that has any")
+    parser.add_argument("--exports", type=int, default=10, help="closed threads to export")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated round trip of every API call")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--relay-concurrency", type=int, default=8)
+    parser.add_argument("--channel-pool", type=int, default=3, help="pre-created channels kept for new threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": max(values, default=0.0) * 1000
+    }
+
+
+class Workload:
+    def __init__(self, args, network, recorder):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.network = network
+        self.recorder = recorder
+        self.guild = FakeGuild(network, recorder)
+        self.staff_role = FakeRole(4242)
+        self.staff = FakeMember("staff", network, recorder, self.guild, [self.staff_role])
+        self.users = [FakeUser(f"user{i}", network, recorder) for i in range(args.users)]
+        self.session = FakeSession(network)
+        self.sequence = 0
+
+    def config(self, storage):
+        return {
+            "guild_id": str(self.guild.id),
+            "modmail_category": str(self.guild.category.id),
+            "staff_roles": [str(self.staff_role.id)],
+            "thread_close_time": 0,
+            "storage": storage,
+            "relay_concurrency": self.args.relay_concurrency,
+            "channel_pool_size": self.args.channel_pool
+        }
+
+    def _attachments(self):
+        if self.random.random() >= self.args.attachment_ratio:
+            return []
+        attachments = [
+            FakeAttachment(f"file{self.sequence}_{i}.bin", self.args.attachment_kb * 1024)
+            for i in range(self.args.attachments_per_message)
+        ]
+        for attachment in attachments:
+            self.session.add(attachment)
+        return attachments
+
+    def message(self, author, channel, direction, guild=None):
+        # The leading token lets the recorder match the relayed embed
+        self.sequence += 1
+        token = f"m{self.sequence}"
+        self.recorder.start(token, direction)
+        return FakeMessage(
+            author,
+            channel,
+            f"{token} benchmark message",
+            guild=guild,
+            attachments=self._attachments()
+        )
+
+
+def make_bot_class(bot_module):
+    class BenchBot(bot_module.ModMailBot):
+        """ModMailBot wired to the fakes instead of the gateway and REST API."""
+
+        def __init__(self, workload):
+            super().__init__()
+            self.workload = workload
+            self.users_by_id = {user.id: user for user in workload.users}
+            self.users_by_id[workload.staff.id] = workload.staff
+
+        @property
+        def user(self):
+            return self.workload.guild.me
+
+        def get_guild(self, guild_id):
+            guild = self.workload.guild
+            return guild if guild.id == guild_id else None
+
+        def get_channel(self, channel_id):
+            return self.workload.guild.get_channel(channel_id)
+
+        def get_user(self, user_id):
+            return self.users_by_id.get(int(user_id))
+
+        async def fetch_user(self, user_id):
+            await self.workload.network.wait()
+            return self.users_by_id.get(int(user_id))
+
+    return BenchBot
+
+
+async def wait_for_relays(modmail):
+    while modmail.relay.stats()["queued"]:
+        await asyncio.sleep(0.001)
+
+
+async def run(args, bot_module):
+    from cogs.modmail import ModMail
+    from cogs.utils import Utils
+
+    network = Latency(args.latency_ms / 1000)
+    recorder = Recorder()
+    workload = Workload(args, network, recorder)
+
+    with open("config.json", "w") as f:
+        json.dump({**bot_module.DEFAULT_CONFIG, **workload.config(args.storage)}, f)
+
+    bot = make_bot_class(bot_module)(workload)
+    report = {"workload": vars(args).copy()}
+    report["workload"].pop("json")
+
+    async with bot:
+        bot.writer.start()
+        await asyncio.get_running_loop().run_in_executor(None, bot.attachments.cache.load)
+        bot.attachments._session = workload.session
+        await bot.add_cog(ModMail(bot))
+        await bot.add_cog(Utils(bot))
+        await bot.load_threads()
+
+        modmail = bot.get_cog("ModMail")
+        utils = bot.get_cog("Utils")
+
+        # Fill the channel pool before timing, as a running bot would have
+        modmail.channel_pool.start()
+        while len(modmail.channel_pool) < args.channel_pool:
+            await asyncio.sleep(0.001)
+
+        tracemalloc.start()
+        started_at = time.perf_counter()
+
+        # Every user opens a thread
+        phase_start = time.perf_counter()
+        for user in workload.users:
+            await modmail.on_message(workload.message(user, user.dm_channel, "open_thread"))
+        await wait_for_relays(modmail)
+        open_time = time.perf_counter() - phase_start
+
+        # Users and staff talk back and forth in every thread
+        channels = {user.id: bot.get_channel(bot.threads[user.id].channel_id) for user in workload.users}
+        phase_start = time.perf_counter()
+        for _ in range(args.messages):
+            for user in workload.users:
+                await modmail.on_message(workload.message(user, user.dm_channel, "dm_to_thread"))
+                await modmail.on_message(workload.message(
+                    workload.staff, channels[user.id], "thread_to_dm", guild=workload.guild
+                ))
+        await wait_for_relays(modmail)
+        relay_time = time.perf_counter() - phase_start
+        relayed = 2 * args.messages * len(workload.users)
+
+        # Close every thread
+        close_latencies = []
+        for user in workload.users:
+            interaction = FakeInteraction(workload.staff, channels[user.id], network)
+            op_start = time.perf_counter()
+            await modmail.close_thread(interaction, channels[user.id].id)
+            close_latencies.append(time.perf_counter() - op_start)
+
+        # Export some of them
+        export_latencies = []
+        for user in workload.users[:args.exports]:
+            interaction = FakeInteraction(workload.staff, channels[user.id], network)
+            op_start = time.perf_counter()
+            await utils.export_thread(interaction, user.id)
+            export_latencies.append(time.perf_counter() - op_start)
+
+        await bot.writer.flush()
+        total_time = time.perf_counter() - started_at
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        report["results"] = {
+            "total_seconds": total_time,
+            "threads_per_second": len(workload.users) / open_time if open_time else 0.0,
+            "messages_per_second": relayed / relay_time if relay_time else 0.0,
+            "latency": {
+                "open_thread": summarize(recorder.latencies["open_thread"]),
+                "dm_to_thread": summarize(recorder.latencies["dm_to_thread"]),
+                "thread_to_dm": summarize(recorder.latencies["thread_to_dm"]),
+                "close_thread": summarize(close_latencies),
+                "export_thread": summarize(export_latencies)
+            },
+            "undelivered": len(recorder.started),
+            "attachment_downloads": workload.session.requests,
+            "relay": modmail.relay.stats(),
+            "channel_pool": {"claimed": modmail.channel_pool.claimed, "misses": modmail.channel_pool.misses},
+            "peak_traced_mb": peak_traced / (1024 * 1024),
+            # ru_maxrss is in KiB on Linux and bytes on macOS
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        }
+
+    return report
+
+
+def print_report(report):
+    results = report["results"]
+    workload = report["workload"]
+    print(
+        f"Workload: {workload['users']} users x {workload['messages']} exchanges, "
+        f"{workload['attachment_ratio']:.0%} attachments of {workload['attachment_kb']} KiB, "
+        f"{workload['latency_ms']} ms API latency, {workload['storage']} storage"
+    )
+    print(f"Total time:         {results['total_seconds']:.2f} s")
+    print(f"Threads opened/sec: {results['threads_per_second']:.1f}")
+    print(f"Messages/sec:       {results['messages_per_second']:.1f}")
+    print()
+    print(f"{'operation':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in results["latency"].items():
+        print(f"{name:<16}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+    print()
+    print(f"Peak traced memory: {results['peak_traced_mb']:.1f} MiB")
+    print(f"Peak RSS:           {results['peak_rss_mb']:.1f} MiB")
+    if results["undelivered"]:
+        print(f"WARNING: {results['undelivered']} messages were never delivered")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    directory = tempfile.mkdtemp(prefix="modmail-bench-")
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    os.chdir(directory)
+    try:
+        # Imported here so bot.log and all state land in the temp directory
+        import bot as bot_module
+        logging.getLogger().setLevel(logging.WARNING)
+        report = asyncio.run(run(args, bot_module))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,24 @@ import os
 import discord
 from discord.ext import commands
 import asyncio
+import copy
 import json
 import logging
+import signal
+import sqlite3
+import time
 from dotenv import load_dotenv
+from core.attachments import AttachmentCache, AttachmentForwarder
+from core.coordinator import StateCoordinator, merge_config
+from core.jobs import JobQueue
+from core.metrics import BotMetrics
+from core.permissions import PermissionModel
+from core.persistence import PersistenceWriter, atomic_write_json
+from core.search import SearchIndex
+from core.storage import create_store
+from core.transcripts import TRANSCRIPT_FORMATS, TranscriptCache, open_rendered, scan_messages
+from core.users import UserResolver
+from core.watchdog import HandlerTimings, LoopWatchdog
 
 # Setup logging
 logging.basicConfig(
@@ -31,6 +46,21 @@ DEFAULT_CONFIG = {
     "staff_roles": [],
     "blocked_users": [],
     "thread_close_time": 12,  # Hours
+    "archive_category": None,  # Closed thread channels are moved here when set
+    "archive_retention": 0,  # Hours before closed thread channels are deleted; 0 keeps them
+    "storage": "json",  # "json" or "sqlite"
+    "relay_concurrency": 8,  # Relays running at once across all threads
+    "relay_max_pending": 500,  # Queued relays before new messages wait
+    "channel_pool_size": 3,  # Hidden channels kept ready for new threads; 0 disables
+    "attachment_cache_mb": 512,
+    "compress_transcripts": False,  # gzip exported transcripts
+    "transcript_formats": list(TRANSCRIPT_FORMATS),  # Rendered when a thread closes: md, html, jsonl
+    "metrics_host": "127.0.0.1",
+    "metrics_port": None,  # Serve Prometheus metrics on this port when set
+    "watchdog": False,  # Log stack traces when the event loop is blocked
+    "watchdog_threshold": 0.5,  # Seconds
+    "sharding": False,  # Share threads and config with other bot processes
+    "shared_state_path": "shared.db",
     "color": {
         "default": 0x5865F2,
         "user": 0x2ECC71,
@@ -41,47 +71,242 @@ DEFAULT_CONFIG = {
     }
 }
 
+# Settings that belong to one process and are never taken from the shared config
+LOCAL_CONFIG_KEYS = (
+    "storage",
+    "metrics_host",
+    "metrics_port",
+    "watchdog",
+    "watchdog_threshold",
+    "sharding",
+    "shared_state_path"
+)
+
+def event_user_id(event):
+    # "open" events carry the whole thread record instead of a user_id
+    user_id = event["thread"]["user_id"] if event["op"] == "open" else event.get("user_id")
+    return int(user_id) if user_id is not None else None
+
+def shard_settings():
+    # SHARD_COUNT and SHARD_IDS (e.g. "0,1") split the shards across processes;
+    # without them every shard Discord recommends runs in this process
+    shard_count = os.getenv("SHARD_COUNT")
+    shard_ids = os.getenv("SHARD_IDS")
+    return (
+        int(shard_count) if shard_count else None,
+        [int(shard_id) for shard_id in shard_ids.split(",")] if shard_ids else None
+    )
+
 class ModMailBot(commands.Bot):
-    def __init__(self):
+    def __init__(self, config=None):
         intents = discord.Intents.default()
         intents.members = True
         intents.message_content = True
         
+        options = {}
+        if isinstance(self, commands.AutoShardedBot):
+            options["shard_count"], options["shard_ids"] = shard_settings()
         super().__init__(
             command_prefix=self.get_prefix,
             intents=intents,
-            help_command=None
+            help_command=None,
+            **options
+        )
+        
+        self.config = config if config is not None else self.load_config()
+        self.permissions = PermissionModel()
+        
+        # With sharding enabled, threads and config are shared between processes
+        self.coordinator = None
+        self.remote_channels = {}
+        storage = self.config.get("storage", "json")
+        if self.config.get("sharding", False):
+            self.coordinator = StateCoordinator(self.config.get("shared_state_path", "shared.db"))
+            self.coordinator.open()
+            shared_config = self.coordinator.load_config()
+            if shared_config is None:
+                # First process to start seeds the shared config from its own
+                self.coordinator.save_config(self.shared_config(self.config))
+            else:
+                self.config = self.merge_shared_config(shared_config)
+            self.coordinator.subscribe("config", self.on_shared_config)
+            self.coordinator.subscribe("thread", self.on_shared_thread)
+            
+            if storage != "sqlite":
+                logger.warning("Sharding needs a storage backend all processes can open. Using SQLite.")
+                storage = "sqlite"
+        
+        self.permissions.rebuild(self.config)
+        self.store = create_store(storage)
+        self.threads = self.store.active
+        self.thread_channels = self.store.channels
+        
+        # Closed history and search backfill load in the background after startup
+        self.history_task = None
+        self.search_task = None
+        self.compaction_task = None
+        
+        # Shared attachment downloader and on-disk cache for relays and exports
+        self.attachments = AttachmentForwarder(
+            AttachmentCache(max_bytes=self.config.get("attachment_cache_mb", 512) * 1024 * 1024)
         )
         
-        self.config = self.load_config()
-        self.threads = {}
-        self.closed_threads = {}
+        # Full-text index over thread messages for "thread search"
+        self.search = SearchIndex("search.db")
+        self.search.open()
+        
+        # Cached user lookups for transcripts and thread info
+        self.user_resolver = UserResolver(self)
+        
+        # Transcripts of closed threads, rendered once when they close
+        self.transcripts = TranscriptCache(
+            self.load_transcript_data,
+            "transcripts",
+            self.config.get("transcript_formats", TRANSCRIPT_FORMATS)
+        )
+        
+        # Durable background work, such as archiving transcripts; survives restarts
+        self.jobs = JobQueue("jobs.db")
+        self.jobs.open()
+        
+        # Counters and histograms, optionally served over HTTP
+        self.metrics = BotMetrics(self)
+        
+        # Handler timings reported by the event loop watchdog
+        self.handler_timings = HandlerTimings()
+        self.watchdog = None
+        self.before_invoke(self.start_command_timer)
+        self.after_invoke(self.stop_command_timer)
+        
+        # Background writer keeps file I/O off the event loop
+        self.writer = PersistenceWriter(on_write=self.metrics.observe_write)
+        self.writer.register("config", lambda: copy.deepcopy(self.config), self.write_config)
+        self.writer.register("thread_events", self.store.drain, self.write_thread_events, self.store.restore)
+        self.writer.register("threads", self.store.snapshot, self.store.write_snapshot, self.store.restore_snapshot)
+        self.writer.register("search", self.search.drain, self.search.write, self.search.restore)
         
     async def get_prefix(self, message):
         return self.config.get("prefix", "!")
-        
-    def load_config(self):
+    
+    @staticmethod
+    def load_config():
         try:
             with open("config.json", "r") as f:
                 config = json.load(f)
                 # Merge with defaults in case of missing fields
                 return {**DEFAULT_CONFIG, **config}
         except FileNotFoundError:
+            # The default config is written out once the bot is ready
             logger.warning("Config file not found. Creating default config.")
-            self.save_config(DEFAULT_CONFIG)
-            return DEFAULT_CONFIG
+            return copy.deepcopy(DEFAULT_CONFIG)
         except json.JSONDecodeError:
             logger.error("Invalid config file. Using default config.")
             return DEFAULT_CONFIG
     
+    def shared_config(self, config):
+        return {key: value for key, value in config.items() if key not in LOCAL_CONFIG_KEYS}
+    
+    def merge_shared_config(self, shared_config):
+        local = {key: self.config[key] for key in LOCAL_CONFIG_KEYS if key in self.config}
+        return {**DEFAULT_CONFIG, **shared_config, **local}
+    
     def save_config(self, config=None):
-        if config is None:
-            config = self.config
+        if config is not None:
+            self.config = config
         
-        with open("config.json", "w") as f:
-            json.dump(config, f, indent=4)
+        # Keep the derived blocklist/staff sets in step with the config
+        self.permissions.rebuild(self.config)
+        
+        # Coalesced and written in the background
+        self.writer.mark_dirty("config")
+    
+    def write_config(self, config):
+        # Runs in the persistence writer's executor thread
+        size = atomic_write_json("config.json", config)
+        if self.coordinator is not None:
+            self.coordinator.save_config(self.shared_config(config))
+        return size
+    
+    def write_thread_events(self, events):
+        # Runs in the persistence writer's executor thread; other processes
+        # reload the touched threads once the events are stored
+        size = self.store.write(events)
+        if self.coordinator is not None and events:
+            self.coordinator.publish("thread", {user_id for user_id in map(event_user_id, events) if user_id is not None})
+        return size
+    
+    async def on_shared_config(self, key):
+        # Another process saved the config; changes of ours that are not
+        # saved yet are merged in rather than dropped
+        base = self.coordinator.config_base
+        shared_config = await asyncio.get_running_loop().run_in_executor(None, self.coordinator.load_config)
+        if shared_config is None:
+            return
+        self.config = self.merge_shared_config(merge_config(base, self.shared_config(self.config), shared_config))
+        self.permissions.rebuild(self.config)
+        self.dispatch("config_changed")
+    
+    async def on_shared_thread(self, key):
+        # Another process opened, closed, deleted or relayed into this user's thread
+        user_id = int(key)
+        await self.store.refresh_thread(user_id)
+        self.dispatch("thread_changed", user_id)
+    
+    def handles_guild(self):
+        # Whether the ModMail guild is on one of this process's shards
+        guild_id = self.config.get("guild_id")
+        return bool(guild_id) and self.get_guild(int(guild_id)) is not None
+    
+    async def resolve_guild(self, guild_id):
+        # Guilds on another process's shards are only reachable over REST
+        guild = self.get_guild(guild_id)
+        if guild is None and self.coordinator is not None:
+            try:
+                guild = await self.fetch_guild(guild_id)
+            except discord.HTTPException:
+                return None
+        return guild
+    
+    async def resolve_channel(self, channel_id):
+        channel = self.get_channel(channel_id)
+        if channel is not None or self.coordinator is None:
+            return channel
+        
+        # Thread channels of a guild on another process's shards
+        channel = self.remote_channels.get(channel_id)
+        if channel is None:
+            try:
+                channel = await self.fetch_channel(channel_id)
+            except discord.HTTPException:
+                return None
+            if len(self.remote_channels) >= 1000:
+                self.remote_channels.clear()
+            self.remote_channels[channel_id] = channel
+        return channel
             
     async def setup_hook(self):
+        self.writer.start()
+        await self.metrics.start(self.config.get("metrics_host", "127.0.0.1"), self.config.get("metrics_port"))
+        await self.apply_watchdog_config()
+        
+        # State is hydrated once here rather than in on_ready, which fires again
+        # on every reconnect; both loads run off the event loop
+        await asyncio.gather(
+            self.load_threads(),
+            asyncio.get_running_loop().run_in_executor(None, self.attachments.cache.load)
+        )
+        
+        # Create threads.json if it doesn't exist
+        if self.config.get("storage", "json") == "json" and not os.path.exists("threads.json"):
+            self.save_threads()
+        
+        # Follow changes made by other processes from here on
+        if self.coordinator is not None:
+            self.coordinator.start()
+        
+        # Threads stored before the search index existed are indexed in the background
+        self.search_task = asyncio.create_task(self.build_search_index(), name="build-search-index")
+        
         # Load cogs
         for filename in os.listdir('./cogs'):
             if filename.endswith('.py') and not filename.startswith('_'):
@@ -90,6 +315,9 @@ class ModMailBot(commands.Bot):
                     logger.info(f"Loaded extension: {filename[:-3]}")
                 except Exception as e:
                     logger.error(f"Failed to load extension {filename}: {e}")
+        
+        # Cogs register their job handlers on load; jobs left from the last run resume now
+        await self.jobs.start()
     
     async def on_ready(self):
         logger.info(f"Logged in as {self.user.name} ({self.user.id})")
@@ -104,35 +332,179 @@ class ModMailBot(commands.Bot):
         # Create config.json if it doesn't exist
         if not os.path.exists("config.json"):
             self.save_config()
-            
-        # Create threads.json if it doesn't exist
-        if not os.path.exists("threads.json"):
-            with open("threads.json", "w") as f:
-                json.dump({"active": {}, "closed": {}}, f, indent=4)
-        else:
-            # Load existing threads
-            self.load_threads()
-    
-    def load_threads(self):
+    
+    async def load_threads(self):
+        # Active threads are loaded first; closed history is indexed in the background
         try:
-            with open("threads.json", "r") as f:
-                data = json.load(f)
-                self.threads = data.get("active", {})
-                self.closed_threads = data.get("closed", {})
-        except (FileNotFoundError, json.JSONDecodeError):
-            logger.error("Failed to load threads. Starting with empty threads.")
-            self.threads = {}
-            self.closed_threads = {}
+            await asyncio.get_running_loop().run_in_executor(None, self.store.load)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Failed to load threads: {e}. Starting with empty threads.")
+        
+        # These are owned by the store and kept up to date by log_thread_event
+        self.threads = self.store.active
+        self.thread_channels = self.store.channels
+        self.history_task = asyncio.create_task(self.load_thread_history(), name="load-thread-history")
+        self.dispatch("threads_loaded")
+    
+    async def load_thread_history(self):
+        started_at = time.perf_counter()
+        try:
+            await self.store.load_history()
+        except Exception as e:
+            logger.error(f"Failed to load closed thread history: {e}")
+            return
+        logger.info(f"Loaded closed thread history in {time.perf_counter() - started_at:.2f}s")
+    
+    async def build_search_index(self):
+        loop = asyncio.get_running_loop()
+        try:
+            if await loop.run_in_executor(None, self.search.is_backfilled):
+                return
+            started_at = time.perf_counter()
+            threads = await self.store.fetch_thread_channels()
+            count = await self.search.backfill(threads, self.store.read_messages)
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Failed to build the search index: {e}")
+            return
+        self.writer.mark_dirty("search")
+        logger.info(f"Indexed {count} messages from {len(threads)} threads in {time.perf_counter() - started_at:.2f}s")
     
     def save_threads(self):
-        with open("threads.json", "w") as f:
-            json.dump({
-                "active": self.threads,
-                "closed": self.closed_threads
-            }, f, indent=4)
+        # Full rewrite of threads.json; compacts the write-ahead log
+        if self.compaction_task is None or self.compaction_task.done():
+            self.compaction_task = asyncio.create_task(self.compact_threads(), name="compact-threads")
+    
+    async def compact_threads(self):
+        # The snapshot holds every closed thread, so the history has to finish
+        # loading in the background first rather than being built on the event loop
+        try:
+            await self.store.load_history()
+        except Exception as e:
+            logger.error(f"Failed to load closed thread history for compaction: {e}")
+            return
+        self.writer.mark_dirty("threads")
+    
+    def log_thread_event(self, op, **data):
+        # Apply a single thread event and persist it without rewriting every thread
+        event = self.store.record(op, **data)
+        self.writer.mark_dirty("thread_events")
+        if self.store.needs_compaction:
+            self.save_threads()
+        
+        # Keep the search index in step
+        if op == "message" and event.get("channel_id") is not None:
+            self.search.add(event["user_id"], event["channel_id"], event["message"])
+            self.writer.mark_dirty("search")
+        elif op == "delete" and event.get("channel_ids"):
+            self.search.remove_channels(event["channel_ids"])
+            self.writer.mark_dirty("search")
+    
+    async def fetch_messages(self, record):
+        # Messages are only kept in storage; flush first so recent ones are included
+        await self.writer.flush()
+        return await self.store.fetch_messages(record)
+    
+    async def load_transcript_data(self, record):
+        # Messages are only kept in storage; flush first so recent ones are
+        # included. They are streamed from the store rather than loaded into
+        # a list, and one pass up front finds the participants and attachments
+        await self.writer.flush()
+        messages = self.store.messages(record.channel_id)
+        author_ids, attachments = await asyncio.get_running_loop().run_in_executor(None, scan_messages, messages)
+        
+        # Resolve every participant once, concurrently, instead of once per message
+        users = await self.user_resolver.resolve_many(author_ids | {record.user_id})
+        names = {user_id: user.name for user_id, user in users.items() if user}
+        return messages, names, attachments
+    
+    async def closed_transcript_parts(self, record, stem, limit):
+        """Return ``(parts, attachments)`` for a closed thread's cached transcripts, split at ``limit``.
+        
+        The caller closes the parts, e.g. through :func:`send_transcript`.
+        """
+        paths, attachments = await self.transcripts.get(record)
+        parts = await asyncio.get_running_loop().run_in_executor(
+            None,
+            open_rendered,
+            paths,
+            stem,
+            limit,
+            self.config.get("compress_transcripts", False)
+        )
+        return parts, attachments
+    
+    async def apply_watchdog_config(self):
+        # (Re)start or stop the watchdog to match the config
+        if self.watchdog is not None:
+            await self.watchdog.close()
+            self.watchdog = None
+        
+        if self.config.get("watchdog", False):
+            self.watchdog = LoopWatchdog(
+                self.handler_timings,
+                threshold=self.config.get("watchdog_threshold", 0.5)
+            )
+            self.watchdog.start()
+    
+    async def start_command_timer(self, ctx):
+        ctx.started_at = time.perf_counter()
+    
+    async def stop_command_timer(self, ctx):
+        started_at = getattr(ctx, "started_at", None)
+        if started_at is not None:
+            self.handler_timings.record(f"command {ctx.command.qualified_name}", time.perf_counter() - started_at)
+    
+    async def close(self):
+        # Unload the cogs first: that drains the relays and stops the schedulers
+        # and channel pool, so nothing records events or queues jobs after the
+        # final flush below
+        for extension in tuple(self.extensions):
+            try:
+                await self.unload_extension(extension)
+            except Exception as e:
+                logger.error(f"Failed to unload extension {extension}: {e}")
+        for cog in tuple(self.cogs):
+            await self.remove_cog(cog)
+        
+        # Flush pending writes before disconnecting
+        for task in (self.history_task, self.search_task, self.compaction_task):
+            if task is not None:
+                task.cancel()
+        if self.watchdog is not None:
+            await self.watchdog.close()
+        await self.jobs.close()
+        await self.writer.close()
+        if self.coordinator is not None:
+            await self.coordinator.close()
+        self.store.close()
+        self.search.close()
+        self.transcripts.close()
+        await self.attachments.close()
+        await self.metrics.close()
+        await super().close()
+
+class ShardedModMailBot(ModMailBot, commands.AutoShardedBot):
+    """ModMailBot running several shards, for use with sharding or SHARD_COUNT/SHARD_IDS."""
+
+def create_bot():
+    # A single process on one shard doesn't need the shard manager
+    config = ModMailBot.load_config()
+    shard_count, shard_ids = shard_settings()
+    if config.get("sharding", False) or shard_count or shard_ids:
+        return ShardedModMailBot(config)
+    return ModMailBot(config)
 
 async def main():
-    bot = ModMailBot()
+    bot = create_bot()
+    
+    # Shut down cleanly (and flush state) when the process manager stops us
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.create_task(bot.close())
+        )
+    except NotImplementedError:
+        pass  # Signal handlers are not available on Windows
+    
     async with bot:
         await bot.start(os.getenv("TOKEN"))
 
@@ -53,6 +53,18 @@ class Config(commands.Cog):
                 if channel:
                     log_channel_name = f"{channel.name} ({log_channel_id})"
         
+        # Get archive category name
+        archive_category_id = config.get("archive_category")
+        archive_category_name = "Not set"
+        if archive_category_id and guild_id:
+            guild = self.bot.get_guild(int(guild_id))
+            if guild:
+                category = guild.get_channel(int(archive_category_id))
+                if category:
+                    archive_category_name = f"{category.name} ({archive_category_id})"
+        
+        archive_retention = config.get("archive_retention", 0)
+        
         # Get staff role names
         staff_roles = config.get("staff_roles", [])
         staff_role_names = []
@@ -86,6 +98,8 @@ class Config(commands.Cog):
         embed.add_field(name="Guild", value=guild_name, inline=False)
         embed.add_field(name="ModMail Category", value=category_name, inline=False)
         embed.add_field(name="Log Channel", value=log_channel_name, inline=False)
+        embed.add_field(name="Archive Category", value=archive_category_name, inline=True)
+        embed.add_field(name="Archive Retention", value=f"{archive_retention} hours" if archive_retention else "Forever", inline=True)
         embed.add_field(name="Staff Roles", value=staff_roles_text, inline=False)
         
         # Create a second embed for blocked users to avoid hitting the field limit
@@ -190,6 +204,35 @@ class Config(commands.Cog):
             )
             await ctx.send(embed=embed)
     
+    @config_group.command(name="archive_category", description="Set the category closed threads are moved to")
+    @commands.has_permissions(administrator=True)
+    async def set_archive_category(self, ctx, category_id: str):
+        """Set the category closed threads are moved to"""
+        try:
+            category_id = int(category_id)
+            category = ctx.guild.get_channel(category_id)
+            
+            if not category or not isinstance(category, discord.CategoryChannel):
+                raise ValueError("Invalid category")
+                
+            self.bot.config["archive_category"] = str(category_id)
+            self.bot.save_config()
+            
+            embed = discord.Embed(
+                title="Archive Category Updated",
+                description=f"Closed threads will be moved to: {category.name}",
+                color=self.bot.config["color"]["success"]
+            )
+            await ctx.send(embed=embed)
+            
+        except (ValueError, discord.HTTPException):
+            embed = discord.Embed(
+                title="Error",
+                description="Please provide a valid category ID.",
+                color=self.bot.config["color"]["error"]
+            )
+            await ctx.send(embed=embed)
+    
     @config_group.command(name="add_staff", description="Add a staff role")
     @commands.has_permissions(administrator=True)
     async def add_staff_role(self, ctx, role_id: str):
@@ -325,12 +368,74 @@ class Config(commands.Cog):
         self.bot.config["thread_close_time"] = hours
         self.bot.save_config()
         
+        # Apply the new close time to threads that are already open
+        modmail_cog = self.bot.get_cog("ModMail")
+        if modmail_cog:
+            modmail_cog.reschedule_auto_close()
+        
         embed = discord.Embed(
             title="Close Time Updated",
             description=f"Thread auto-close time set to {hours} hours.",
             color=self.bot.config["color"]["success"]
         )
         await ctx.send(embed=embed)
+    
+    @config_group.command(name="archive_retention", description="Set how long closed thread channels are kept (in hours)")
+    @commands.has_permissions(administrator=True)
+    async def set_archive_retention(self, ctx, hours: int):
+        """Set how long closed thread channels are kept (in hours, 0 keeps them)"""
+        if hours < 0:
+            embed = discord.Embed(
+                title="Error",
+                description="Please provide a positive number of hours.",
+                color=self.bot.config["color"]["error"]
+            )
+            await ctx.send(embed=embed)
+            return
+            
+        self.bot.config["archive_retention"] = hours
+        self.bot.save_config()
+        
+        if hours:
+            description = f"Closed thread channels will be deleted after {hours} hours."
+        else:
+            description = "Closed thread channels will be kept."
+        embed = discord.Embed(
+            title="Archive Retention Updated",
+            description=description,
+            color=self.bot.config["color"]["success"]
+        )
+        await ctx.send(embed=embed)
+    
+    @config_group.command(name="watchdog", description="Toggle the event loop watchdog")
+    @commands.has_permissions(administrator=True)
+    async def set_watchdog(self, ctx, enabled: bool, threshold: float = None):
+        """Toggle the event loop watchdog and optionally set its threshold (in seconds)"""
+        if threshold is not None and threshold <= 0:
+            embed = discord.Embed(
+                title="Error",
+                description="Please provide a positive threshold in seconds.",
+                color=self.bot.config["color"]["error"]
+            )
+            await ctx.send(embed=embed)
+            return
+        
+        self.bot.config["watchdog"] = enabled
+        if threshold is not None:
+            self.bot.config["watchdog_threshold"] = threshold
+        self.bot.save_config()
+        await self.bot.apply_watchdog_config()
+        
+        if enabled:
+            description = f"Watchdog enabled. Stalls longer than {self.bot.config.get('watchdog_threshold', 0.5)} seconds are logged."
+        else:
+            description = "Watchdog disabled."
+        embed = discord.Embed(
+            title="Watchdog Updated",
+            description=description,
+            color=self.bot.config["color"]["success"]
+        )
+        await ctx.send(embed=embed)
 
 async def setup(bot):
     await bot.add_cog(Config(bot))
\ No newline at end of file
@@ -4,19 +4,40 @@ from discord.ext import commands
 import asyncio
 import datetime
 import json
+import time
+from core.attachments import add_attachment_fields
+from core.channel_pool import POOL_TOPIC, ChannelPool
+from core.concurrency import KeyedLock
+from core.models import ThreadRecord, to_datetime
+from core.relay import RelayPipeline
+from core.scheduler import DeadlineScheduler
+from core.transcripts import send_transcript, transcript_limit
+
+# Seconds a closed thread channel keeps its name, so the closing message can be read
+ARCHIVE_DELAY = 10
 
 class ThreadView(discord.ui.View):
-    def __init__(self, thread_id, bot):
+    # Registered once at startup so the buttons on every thread channel keep
+    # working after a restart; the thread is looked up from the channel
+    def __init__(self, bot):
         super().__init__(timeout=None)
-        self.thread_id = thread_id
         self.bot = bot
     
+    async def resolve_thread(self, interaction):
+        # Each ticket has its own channel, so a user's other threads are never touched
+        record = await self.bot.store.fetch_thread_by_channel(interaction.channel.id)
+        if record is None:
+            await interaction.response.send_message("Thread not found.", ephemeral=True)
+        return record
+    
     @discord.ui.button(label="Close", style=discord.ButtonStyle.gray, emoji="🔒", custom_id="thread:close")
     async def close_thread(self, interaction: discord.Interaction, button: discord.ui.Button):
         # Get cog instance
         modmail_cog = self.bot.get_cog("ModMail")
         if modmail_cog:
-            await modmail_cog.close_thread(interaction, self.thread_id)
+            record = await self.resolve_thread(interaction)
+            if record is not None:
+                await modmail_cog.close_thread(interaction, record.channel_id)
         else:
             await interaction.response.send_message("Error: ModMail cog not found.", ephemeral=True)
     
@@ -24,7 +45,9 @@ class ThreadView(discord.ui.View):
     async def block_user(self, interaction: discord.Interaction, button: discord.ui.Button):
         modmail_cog = self.bot.get_cog("ModMail")
         if modmail_cog:
-            await modmail_cog.block_user(interaction, self.thread_id)
+            record = await self.resolve_thread(interaction)
+            if record is not None:
+                await modmail_cog.block_user(interaction, record.user_id, record.channel_id)
         else:
             await interaction.response.send_message("Error: ModMail cog not found.", ephemeral=True)
     
@@ -32,6 +55,10 @@ class ThreadView(discord.ui.View):
     async def delete_thread(self, interaction: discord.Interaction, button: discord.ui.Button):
         modmail_cog = self.bot.get_cog("ModMail")
         if modmail_cog:
+            record = await self.resolve_thread(interaction)
+            if record is None:
+                return
+            
             # Ask for confirmation
             confirm_view = ConfirmView()
             await interaction.response.send_message(
@@ -43,7 +70,7 @@ class ThreadView(discord.ui.View):
             # Wait for confirmation
             await confirm_view.wait()
             if confirm_view.value:
-                await modmail_cog.delete_thread(interaction, self.thread_id)
+                await modmail_cog.delete_thread(interaction, record.channel_id)
             else:
                 await interaction.followup.send("Thread deletion cancelled.", ephemeral=True)
         else:
@@ -69,6 +96,124 @@ class ConfirmView(discord.ui.View):
 class ModMail(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Serializes thread creation per user so a burst of DMs opens one channel
+        self.creation_locks = KeyedLock()
+        # Per-thread FIFO relay queues sharing a global concurrency limit
+        self.relay = RelayPipeline(
+            max_concurrency=self.bot.config.get("relay_concurrency", 8),
+            max_pending=self.bot.config.get("relay_max_pending", 500),
+            on_job=self.bot.handler_timings.record
+        )
+        # Idle threads are closed once thread_close_time passes without activity
+        self.auto_close = DeadlineScheduler(self.auto_close_thread)
+        # Hidden channels created ahead of time for new threads
+        self.channel_pool = ChannelPool(
+            self.create_pool_channel,
+            self.bot.get_channel,
+            self.delete_pool_channel,
+            size=self.bot.config.get("channel_pool_size", 3)
+        )
+        self.pool_task = None
+    
+    async def cog_load(self):
+        self.bot.add_view(ThreadView(bot=self.bot))
+        self.bot.jobs.register("archive", self.archive_transcript)
+        self.bot.jobs.register("channel_edit", self.edit_channel)
+        self.bot.jobs.register("channel_delete", self.delete_archived_channel)
+        self.auto_close.start()
+        self.reschedule_auto_close()
+        self.pool_task = asyncio.create_task(self.start_channel_pool(), name="start-channel-pool")
+    
+    async def cog_unload(self):
+        if self.pool_task is not None:
+            self.pool_task.cancel()
+        await self.channel_pool.close()
+        await self.relay.close()
+        await self.auto_close.close()
+    
+    @commands.Cog.listener()
+    async def on_threads_loaded(self):
+        self.reschedule_auto_close()
+    
+    @commands.Cog.listener()
+    async def on_thread_changed(self, user_id):
+        # Another process changed this thread; its record has been reloaded
+        self._schedule_auto_close(user_id)
+    
+    @commands.Cog.listener()
+    async def on_config_changed(self):
+        # Another process saved the config, possibly with a new thread_close_time
+        self.reschedule_auto_close()
+        self.channel_pool.resize(self.bot.config.get("channel_pool_size", 3))
+    
+    def reschedule_auto_close(self):
+        # Called when threads are loaded and when thread_close_time changes
+        self.auto_close.clear()
+        for user_id in self.bot.threads:
+            self._schedule_auto_close(user_id)
+    
+    def _schedule_auto_close(self, user_id):
+        record = self.bot.threads.get(user_id)
+        hours = self.bot.config.get("thread_close_time", 12)
+        if record is None or not hours:
+            # 0 disables auto-close
+            self.auto_close.cancel(user_id)
+            return
+        
+        self.auto_close.schedule(user_id, record.last_activity + hours * 3600)
+    
+    def touch_thread(self, user_id):
+        # The thread record already holds the new last activity
+        self._schedule_auto_close(user_id)
+    
+    def forget_thread(self, user_id):
+        self.auto_close.cancel(user_id)
+    
+    async def start_channel_pool(self):
+        # Channels are only pooled by the process serving the guild
+        await self.bot.wait_until_ready()
+        if self.bot.coordinator is not None and not self.bot.handles_guild():
+            return
+        
+        category_id = self.bot.config.get("modmail_category")
+        category = self.bot.get_channel(int(category_id)) if category_id else None
+        if isinstance(category, discord.CategoryChannel):
+            # A thread whose rename never ran still has the pool topic
+            thread_channels = {channel_id for _, channel_id in await self.bot.store.fetch_thread_channels()}
+            self.channel_pool.adopt(
+                channel.id for channel in category.text_channels
+                if channel.topic == POOL_TOPIC and channel.id not in thread_channels
+            )
+        self.channel_pool.start()
+    
+    async def create_pool_channel(self):
+        guild_id = self.bot.config.get("guild_id")
+        category_id = self.bot.config.get("modmail_category")
+        if not guild_id or not category_id:
+            return None
+        
+        guild = self.bot.get_guild(int(guild_id))
+        category = self.bot.get_channel(int(category_id))
+        if not guild or not category:
+            return None
+        
+        # Hidden from everyone, staff included, until a thread claims it
+        overwrites = {
+            guild.default_role: discord.PermissionOverwrite(view_channel=False),
+            guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, embed_links=True, attach_files=True)
+        }
+        return await guild.create_text_channel(
+            name="modmail-pending",
+            category=category,
+            topic=POOL_TOPIC,
+            overwrites=overwrites
+        )
+    
+    async def delete_pool_channel(self, channel):
+        try:
+            await channel.delete(reason="No longer needed in the ModMail channel pool")
+        except discord.NotFound:
+            pass
         
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -76,13 +221,13 @@ class ModMail(commands.Cog):
         if message.author.bot:
             return
         
-        # Handle DM messages
+        # Handle DM messages, in order per user
         if isinstance(message.channel, discord.DMChannel):
-            await self.handle_dm(message)
+            await self.relay.submit(("dm", message.author.id), self.handle_dm, message)
         
-        # Handle thread channel messages
+        # Handle thread channel messages, in order per channel
         elif message.guild and self.is_thread_channel(message.channel):
-            await self.handle_thread_message(message)
+            await self.relay.submit(("thread", message.channel.id), self.handle_thread_message, message)
     
     def is_thread_channel(self, channel):
         # Check if the channel is in the modmail category and is a thread channel
@@ -93,13 +238,13 @@ class ModMail(commands.Cog):
         if not category_id:
             return False
             
-        return channel.category_id == int(category_id) and str(channel.id) in self.bot.threads
+        return channel.category_id == int(category_id) and channel.id in self.bot.thread_channels
     
     async def handle_dm(self, message):
-        author_id = str(message.author.id)
+        author_id = message.author.id
         
         # Check if user is blocked
-        if author_id in self.bot.config.get("blocked_users", []):
+        if self.bot.permissions.is_blocked(message.author.id):
             embed = discord.Embed(
                 title="You are blocked",
                 description="You have been blocked from using the modmail system.",
@@ -112,12 +257,20 @@ class ModMail(commands.Cog):
             return
         
         # Check if a thread already exists
-        if author_id in self.bot.threads:
-            thread_id = self.bot.threads[author_id]["channel_id"]
+        if author_id in self.bot.threads and not self.creation_locks.locked(author_id):
+            thread_id = self.bot.threads[author_id].channel_id
             await self.forward_to_thread(message, thread_id)
-        else:
-            # Create a new thread
-            await self.create_thread(message)
+            return
+        
+        # DMs that arrive while the thread is being created wait here, in order,
+        # and are then relayed into the channel the first one created
+        async with self.creation_locks(author_id):
+            if author_id in self.bot.threads:
+                thread_id = self.bot.threads[author_id].channel_id
+                await self.forward_to_thread(message, thread_id)
+            else:
+                # Create a new thread
+                await self.create_thread(message)
     
     async def create_thread(self, message):
         guild_id = self.bot.config.get("guild_id")
@@ -132,11 +285,11 @@ class ModMail(commands.Cog):
             await message.author.send(embed=embed)
             return
         
-        guild = self.bot.get_guild(int(guild_id))
+        guild = await self.bot.resolve_guild(int(guild_id))
         if not guild:
             return
             
-        category = guild.get_channel(int(category_id))
+        category = await self.bot.resolve_channel(int(category_id))
         if not category:
             return
         
@@ -144,23 +297,40 @@ class ModMail(commands.Cog):
         channel_name = f"{message.author.name}-{message.author.discriminator}"
         if message.author.discriminator == "0":  # Handle new username system
             channel_name = f"{message.author.name}"
-            
-        channel = await guild.create_text_channel(
-            name=channel_name,
-            category=category,
-            topic=f"ModMail thread for {message.author.name} ({message.author.id})"
-        )
+        topic = f"ModMail thread for {message.author.name} ({message.author.id})"
         
-        # Create thread object
-        thread_data = {
-            "user_id": str(message.author.id),
-            "channel_id": str(channel.id),
-            "created_at": datetime.datetime.utcnow().isoformat(),
-            "messages": []
-        }
+        # A pooled channel is shown to staff right away by syncing the
+        # category's permissions; the rate-limited rename runs in the background
+        channel = self.channel_pool.claim(lambda pooled: pooled.category_id == category.id)
+        if channel is not None:
+            try:
+                await channel.edit(sync_permissions=True)
+            except discord.HTTPException:
+                # Never hand out a channel staff can't see; make a new one instead
+                self.channel_pool.discard(channel)
+                channel = None
+        if channel is not None:
+            await self.bot.jobs.enqueue(
+                "channel_edit",
+                {"channel_id": channel.id, "name": channel_name, "topic": topic},
+                key=f"channel_edit:{channel.id}"
+            )
+        else:
+            channel = await guild.create_text_channel(
+                name=channel_name,
+                category=category,
+                topic=topic
+            )
+        
+        # Create thread record
+        record = ThreadRecord(
+            user_id=message.author.id,
+            channel_id=channel.id,
+            created_at=time.time()
+        )
         
-        self.bot.threads[str(message.author.id)] = thread_data
-        self.bot.save_threads()
+        self.bot.log_thread_event("open", thread=record.to_dict())
+        self.touch_thread(message.author.id)
         
         # Send welcome message to the channel
         embed = discord.Embed(
@@ -172,23 +342,24 @@ class ModMail(commands.Cog):
         embed.set_footer(text=f"User ID: {message.author.id}")
         embed.set_thumbnail(url=message.author.avatar.url if message.author.avatar else message.author.default_avatar.url)
         
-        thread_view = ThreadView(thread_id=str(message.author.id), bot=self.bot)
-        await channel.send(embed=embed, view=thread_view)
+        thread_view = ThreadView(bot=self.bot)
         
-        # Forward the initial message
-        await self.forward_to_thread(message, str(channel.id))
+        async def set_up_channel():
+            await channel.send(embed=embed, view=thread_view)
+            # Forward the initial message
+            await self.forward_to_thread(message, channel.id)
         
-        # Send confirmation to user
+        # Send confirmation to user while the channel is set up
         user_embed = discord.Embed(
             title="ModMail Thread Created",
             description="Your message has been sent to the staff. Please wait for a response.",
             color=self.bot.config["color"]["success"],
             timestamp=datetime.datetime.now()
         )
-        await message.author.send(embed=user_embed)
+        await asyncio.gather(set_up_channel(), message.author.send(embed=user_embed))
     
     async def forward_to_thread(self, message, thread_id):
-        channel = self.bot.get_channel(int(thread_id))
+        channel = await self.bot.resolve_channel(int(thread_id))
         if not channel:
             return
         
@@ -203,53 +374,37 @@ class ModMail(commands.Cog):
             icon_url=message.author.avatar.url if message.author.avatar else message.author.default_avatar.url
         )
         
-        # Handle attachments
-        files = []
-        if message.attachments:
-            attachment_text = []
-            for i, attachment in enumerate(message.attachments):
-                try:
-                    file = await attachment.to_file()
-                    files.append(file)
-                    attachment_text.append(f"[Attachment {i+1}]")
-                except discord.HTTPException:
-                    attachment_text.append(f"[Attachment {i+1} (too large to forward)]")
-            
+        # Handle attachments (downloaded in parallel, oversized ones sent as links)
+        async with self.bot.attachments.prepare(message.attachments, channel) as (files, attachment_text, attachment_records):
             if attachment_text:
-                embed.add_field(name="Attachments", value="\n".join(attachment_text))
+                add_attachment_fields(embed, attachment_text)
+            
+            # Send the message
+            sent_message = await channel.send(embed=embed, files=files)
         
-        # Send the message
-        sent_message = await channel.send(embed=embed, files=files)
+        self.bot.metrics.relay_latency.observe(
+            (discord.utils.utcnow() - message.created_at).total_seconds(),
+            direction="dm_to_thread"
+        )
         
         # Store message in thread data
-        user_id = None
-        for uid, thread_data in self.bot.threads.items():
-            if thread_data["channel_id"] == thread_id:
-                user_id = uid
-                break
-        
+        user_id = self.bot.thread_channels.get(channel.id)
         if user_id:
-            if "messages" not in self.bot.threads[user_id]:
-                self.bot.threads[user_id]["messages"] = []
-            
-            self.bot.threads[user_id]["messages"].append({
+            message_data = {
                 "message_id": str(sent_message.id),
                 "content": message.content,
                 "author_id": str(message.author.id),
                 "created_at": datetime.datetime.utcnow().isoformat(),
                 "is_staff": False
-            })
-            
-            self.bot.save_threads()
+            }
+            if attachment_records:
+                message_data["attachments"] = attachment_records
+            self.bot.log_thread_event("message", user_id=user_id, message=message_data)
+            self.touch_thread(user_id)
     
     async def handle_thread_message(self, message):
         # Get the user associated with this thread
-        user_id = None
-        for uid, thread_data in self.bot.threads.items():
-            if thread_data["channel_id"] == str(message.channel.id):
-                user_id = uid
-                break
-        
+        user_id = self.bot.thread_channels.get(message.channel.id)
         if not user_id:
             return
         
@@ -295,41 +450,35 @@ class ModMail(commands.Cog):
             icon_url=message.author.avatar.url if message.author.avatar else message.author.default_avatar.url
         )
         
-        # Handle attachments
-        files = []
-        if message.attachments:
-            attachment_text = []
-            for i, attachment in enumerate(message.attachments):
-                try:
-                    file = await attachment.to_file()
-                    files.append(file)
-                    attachment_text.append(f"[Attachment {i+1}]")
-                except discord.HTTPException:
-                    attachment_text.append(f"[Attachment {i+1} (too large to forward)]")
-            
-            if attachment_text:
-                embed.add_field(name="Attachments", value="\n".join(attachment_text))
-        
         # Send message to user
         try:
-            sent_message = await user.send(embed=embed, files=files)
+            # Handle attachments (downloaded in parallel, oversized ones sent as links)
+            async with self.bot.attachments.prepare(message.attachments, user) as (files, attachment_text, attachment_records):
+                if attachment_text:
+                    add_attachment_fields(embed, attachment_text)
+                
+                sent_message = await user.send(embed=embed, files=files)
+            
+            self.bot.metrics.relay_latency.observe(
+                (discord.utils.utcnow() - message.created_at).total_seconds(),
+                direction="thread_to_dm"
+            )
             
             # Add reaction to original message to indicate it was sent
             await message.add_reaction("✅")
             
             # Save the message to the thread data
-            if "messages" not in self.bot.threads[user_id]:
-                self.bot.threads[user_id]["messages"] = []
-            
-            self.bot.threads[user_id]["messages"].append({
+            message_data = {
                 "message_id": str(message.id),
                 "content": message.content,
                 "author_id": str(message.author.id),
                 "created_at": datetime.datetime.utcnow().isoformat(),
                 "is_staff": True
-            })
-            
-            self.bot.save_threads()
+            }
+            if attachment_records:
+                message_data["attachments"] = attachment_records
+            self.bot.log_thread_event("message", user_id=user_id, message=message_data)
+            self.touch_thread(user_id)
             
         except discord.HTTPException as e:
             await message.add_reaction("❌")
@@ -337,40 +486,43 @@ class ModMail(commands.Cog):
     
     async def check_staff_permissions(self, member):
         # Check if the member has any of the staff roles
-        staff_roles = self.bot.config.get("staff_roles", [])
-        return any(str(role.id) in staff_roles for role in member.roles)
+        return self.bot.permissions.is_staff(member)
     
-    async def close_thread(self, interaction, thread_id):
-        # Get the channel
-        thread_data = self.bot.threads.get(thread_id)
-        if not thread_data:
-            await interaction.response.send_message("Thread not found.", ephemeral=True)
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        # Staff status is cached per member until their roles change
+        if before.roles != after.roles:
+            self.bot.permissions.invalidate_member(after)
+    
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.bot.permissions.invalidate_member(member)
+    
+    async def close_thread(self, interaction, channel_id):
+        # Only the channel of the user's open thread can be closed
+        thread_id = self.bot.thread_channels.get(channel_id)
+        record = self.bot.threads.get(thread_id) if thread_id is not None else None
+        if not record:
+            await interaction.response.send_message("This thread is already closed.", ephemeral=True)
             return
         
-        channel_id = thread_data["channel_id"]
-        channel = self.bot.get_channel(int(channel_id))
+        channel = await self.bot.resolve_channel(record.channel_id)
         
         # Notify user that thread is being closed
-        try:
-            user = await self.bot.fetch_user(int(thread_id))
-            embed = discord.Embed(
-                title="Thread Closed",
-                description="This ModMail thread has been closed by a staff member. If you need further assistance, feel free to send another message to create a new thread.",
-                color=self.bot.config["color"]["warning"],
-                timestamp=datetime.datetime.now()
-            )
-            await user.send(embed=embed)
-        except discord.HTTPException:
-            pass
+        await self.notify_thread_closed(
+            thread_id,
+            "This ModMail thread has been closed by a staff member. If you need further assistance, feel free to send another message to create a new thread."
+        )
         
         # Move thread to closed threads
-        self.bot.closed_threads[thread_id] = thread_data
-        self.bot.closed_threads[thread_id]["closed_at"] = datetime.datetime.utcnow().isoformat()
-        self.bot.closed_threads[thread_id]["closed_by"] = str(interaction.user.id)
-        
-        # Remove from active threads
-        del self.bot.threads[thread_id]
-        self.bot.save_threads()
+        self.bot.log_thread_event(
+            "close",
+            user_id=thread_id,
+            closed_at=time.time(),
+            closed_by=interaction.user.id
+        )
+        self.forget_thread(thread_id)
+        self.bot.transcripts.prerender(record)
         
         # Send closure notification to channel
         embed = discord.Embed(
@@ -381,19 +533,184 @@ class ModMail(commands.Cog):
         )
         await interaction.response.send_message(embed=embed)
         
-        # Archive the channel after a delay
-        await asyncio.sleep(10)
+        await self.queue_archive(record)
+        await self.archive_channel(channel)
+    
+    async def auto_close_thread(self, thread_id):
+        # Deadlines that passed while the bot was down fire during startup,
+        # before the guild and its channels are available
+        await self.bot.wait_until_ready()
+        
+        # The thread may have been closed or answered in the meantime
+        record = self.bot.threads.get(thread_id)
+        hours = self.bot.config.get("thread_close_time", 12)
+        if not record or not hours or record.last_activity + hours * 3600 > time.time():
+            return
+        
+        # With several processes only the one serving the guild closes threads
+        if self.bot.coordinator is not None and not self.bot.handles_guild():
+            return
+        
+        channel = await self.bot.resolve_channel(record.channel_id)
+        
+        await self.notify_thread_closed(
+            thread_id,
+            "This ModMail thread has been closed due to inactivity. If you need further assistance, feel free to send another message to create a new thread."
+        )
+        
+        self.bot.log_thread_event(
+            "close",
+            user_id=thread_id,
+            closed_at=time.time(),
+            closed_by=self.bot.user.id
+        )
+        self.forget_thread(thread_id)
+        self.bot.transcripts.prerender(record)
+        
         if channel:
+            embed = discord.Embed(
+                title="Thread Closed",
+                description=f"This thread has been closed automatically after {hours} hours of inactivity.",
+                color=self.bot.config["color"]["warning"],
+                timestamp=datetime.datetime.now()
+            )
             try:
-                # Change channel name to indicate it's closed
-                await channel.edit(name=f"closed-{channel.name}")
+                await channel.send(embed=embed)
             except discord.HTTPException:
                 pass
+        
+        await self.queue_archive(record)
+        await self.archive_channel(channel)
+    
+    async def notify_thread_closed(self, thread_id, description):
+        try:
+            user = await self.bot.fetch_user(int(thread_id))
+            embed = discord.Embed(
+                title="Thread Closed",
+                description=description,
+                color=self.bot.config["color"]["warning"],
+                timestamp=datetime.datetime.now()
+            )
+            await user.send(embed=embed)
+        except discord.HTTPException:
+            pass
+    
+    async def queue_archive(self, record):
+        # Posted to the log channel by the job queue, so closing never waits on it
+        if self.bot.config.get("log_channel"):
+            # Keyed by channel so deleting the thread can cancel it
+            await self.bot.jobs.enqueue("archive", {"thread": record.to_dict()}, key=f"archive:{record.channel_id}")
+    
+    async def archive_transcript(self, payload):
+        """Job handler: post a closed thread's summary and transcripts to the log channel.
+        
+        Failed sends are retried by the job queue, so a summary can be posted
+        twice if a later batch of files fails.
+        """
+        log_channel_id = self.bot.config.get("log_channel")
+        if not log_channel_id:
+            return
+        
+        # Jobs resumed at startup run before the channel cache is filled
+        await self.bot.wait_until_ready()
+        log_channel = await self.bot.resolve_channel(int(log_channel_id))
+        if log_channel is None:
+            raise LookupError(f"Log channel {log_channel_id} not found")
+        
+        record = ThreadRecord.from_dict(payload["thread"])
+        if await self.bot.store.fetch_thread_by_channel(record.channel_id) is None:
+            # Deleted by staff while the job was running
+            return
+        
+        user = await self.bot.user_resolver.resolve(record.user_id)
+        user_name = user.name if user else f"Unknown_{record.user_id}"
+        closed_at = to_datetime(record.closed_at)
+        duration = closed_at - to_datetime(record.created_at)
+        
+        embed = discord.Embed(
+            title="Thread Archived",
+            color=self.bot.config["color"]["default"],
+            timestamp=closed_at.replace(tzinfo=datetime.timezone.utc)
+        )
+        embed.add_field(name="User", value=f"{user.mention if user else 'Unknown'} ({record.user_id})", inline=False)
+        embed.add_field(name="Channel ID", value=str(record.channel_id), inline=True)
+        embed.add_field(name="Messages", value=str(record.message_count), inline=True)
+        embed.add_field(name="Closed By", value=f"<@{record.closed_by}>" if record.closed_by else "Unknown", inline=True)
+        embed.add_field(name="Created", value=to_datetime(record.created_at).strftime("%Y-%m-%d %H:%M:%S UTC"), inline=True)
+        embed.add_field(name="Open For", value=f"{duration.days} days, {duration.seconds // 3600} hours", inline=True)
+        embed.set_footer(text=f"User ID: {record.user_id}")
+        
+        limit = transcript_limit(log_channel)
+        stem = f"transcript_{user_name}_{closed_at.strftime('%Y%m%d_%H%M%S')}"
+        parts, attachments = [], []
+        if record.message_count:
+            parts, attachments = await self.bot.closed_transcript_parts(record, stem, limit)
+        await send_transcript(log_channel.send, parts, attachments, self.bot.attachments.open_cached, limit, embed=embed)
+    
+    async def archive_channel(self, channel):
+        # Renamed (and moved) by the job queue, so it survives restarts;
+        # edits queued for the same channel are merged into one
+        if not channel:
+            return
+        
+        edit = {"channel_id": channel.id}
+        if not channel.name.startswith("closed-"):
+            edit["name"] = f"closed-{channel.name}"
+        archive_category = self.bot.config.get("archive_category")
+        if archive_category:
+            edit["category_id"] = int(archive_category)
+        await self.bot.jobs.enqueue("channel_edit", edit, delay=ARCHIVE_DELAY, key=f"channel_edit:{channel.id}")
+        
+        hours = self.bot.config.get("archive_retention", 0)
+        if hours:
+            # 0 keeps archived channels
+            await self.bot.jobs.enqueue(
+                "channel_delete",
+                {"channel_id": channel.id},
+                delay=hours * 3600,
+                key=f"channel_delete:{channel.id}"
+            )
+    
+    async def edit_channel(self, payload):
+        """Job handler: bring a channel in line with the requested name, topic and category in one edit."""
+        await self.bot.wait_until_ready()
+        channel = await self.bot.resolve_channel(payload["channel_id"])
+        if channel is None:
+            return
+        
+        fields = {}
+        if "name" in payload and channel.name != payload["name"]:
+            fields["name"] = payload["name"]
+        if "topic" in payload and channel.topic != payload["topic"]:
+            fields["topic"] = payload["topic"]
+        if "category_id" in payload and channel.category_id != payload["category_id"]:
+            category = await self.bot.resolve_channel(payload["category_id"])
+            if isinstance(category, discord.CategoryChannel):
+                fields["category"] = category
+        if not fields:
+            return
+        
+        try:
+            await channel.edit(**fields)
+        except discord.NotFound:
+            pass
     
-    async def block_user(self, interaction, thread_id):
+    async def delete_archived_channel(self, payload):
+        """Job handler: delete an archived channel once its retention period is over."""
+        await self.bot.wait_until_ready()
+        channel = await self.bot.resolve_channel(payload["channel_id"])
+        if channel is None:
+            return
+        
+        try:
+            await channel.delete(reason="Archived thread retention period ended")
+        except discord.NotFound:
+            pass
+    
+    async def block_user(self, interaction, thread_id, channel_id):
         # Add user to blocked list
-        if thread_id not in self.bot.config["blocked_users"]:
-            self.bot.config["blocked_users"].append(thread_id)
+        if not self.bot.permissions.is_blocked(thread_id):
+            self.bot.config["blocked_users"].append(str(thread_id))
             self.bot.save_config()
             
             # Notify user they are blocked
@@ -409,30 +726,34 @@ class ModMail(commands.Cog):
             except discord.HTTPException:
                 pass
             
-            # Close the thread
-            await self.close_thread(interaction, thread_id)
+            # Close the thread, if this channel is the one still open
+            if self.bot.thread_channels.get(channel_id) == thread_id:
+                await self.close_thread(interaction, channel_id)
             
-            await interaction.response.send_message("User has been blocked from using ModMail.", ephemeral=True)
+            if interaction.response.is_done():
+                await interaction.followup.send("User has been blocked from using ModMail.", ephemeral=True)
+            else:
+                await interaction.response.send_message("User has been blocked from using ModMail.", ephemeral=True)
         else:
             await interaction.response.send_message("This user is already blocked.", ephemeral=True)
     
-    async def delete_thread(self, interaction, thread_id):
-        # Get the channel
-        thread_data = self.bot.threads.get(thread_id) or self.bot.closed_threads.get(thread_id)
-        if not thread_data:
+    async def delete_thread(self, interaction, channel_id):
+        # Get the thread of this channel, not whichever of the user's threads is latest
+        record = await self.bot.store.fetch_thread_by_channel(channel_id)
+        if not record:
             await interaction.followup.send("Thread not found.", ephemeral=True)
             return
         
-        channel_id = thread_data["channel_id"]
-        channel = self.bot.get_channel(int(channel_id))
-        
-        # Remove thread from both active and closed threads
-        if thread_id in self.bot.threads:
-            del self.bot.threads[thread_id]
-        if thread_id in self.bot.closed_threads:
-            del self.bot.closed_threads[thread_id]
+        thread_id = record.user_id
+        channel = await self.bot.resolve_channel(record.channel_id)
         
-        self.bot.save_threads()
+        # Remove this thread; the user's other past threads are kept
+        self.bot.log_thread_event("delete", user_id=thread_id, channel_id=record.channel_id)
+        self.forget_thread(thread_id)
+        await self.bot.jobs.cancel(f"archive:{record.channel_id}")
+        await self.bot.jobs.cancel(f"channel_edit:{record.channel_id}")
+        await self.bot.jobs.cancel(f"channel_delete:{record.channel_id}")
+        await self.bot.transcripts.discard(record.channel_id)
         
         # Delete the channel
         if channel:
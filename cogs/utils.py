@@ -1,11 +1,31 @@
 import discord
 from discord.ext import commands
+import asyncio
 import datetime
-import io
 import json
+import re
+from core.models import to_datetime
+from core.search import SearchQuery, hit_key
+from core.storage import closed_key, created_key, page_records
+from core.transcripts import render_markdown, send_transcript, transcript_limit, write_transcript
+
+# Threads shown per page of a listing
+PAGE_SIZE = 10
+
+def info_user_id(message):
+    """Return the user ID a thread info message is about, or None."""
+    for embed in message.embeds if message else ():
+        # The footer names the user; older messages only have it in the title
+        for text in (embed.footer.text, embed.title):
+            match = re.search(r"User ID: (\d+)$|\((\d+)\)$", text or "")
+            if match:
+                return int(match.group(1) or match.group(2))
+    return None
 
 class ThreadLogView(discord.ui.View):
-    def __init__(self, thread_id, bot):
+    # Registered once at startup without a thread_id so the export buttons on
+    # earlier thread info messages keep working after a restart
+    def __init__(self, bot, thread_id=None):
         super().__init__(timeout=None)
         self.thread_id = thread_id
         self.bot = bot
@@ -14,14 +34,79 @@ class ThreadLogView(discord.ui.View):
     async def export_thread(self, interaction: discord.Interaction, button: discord.ui.Button):
         utils_cog = self.bot.get_cog("Utils")
         if utils_cog:
-            await utils_cog.export_thread(interaction, self.thread_id)
+            thread_id = self.thread_id
+            if thread_id is None:
+                thread_id = info_user_id(interaction.message)
+            if thread_id is None:
+                await interaction.response.send_message("Thread not found.", ephemeral=True)
+                return
+            await utils_cog.export_thread(interaction, thread_id)
         else:
             await interaction.response.send_message("Error: Utils cog not found.", ephemeral=True)
 
+class ThreadListView(discord.ui.View):
+    """Cursor-paginated thread listing.
+
+    ``fetch(limit, before=None, after=None)`` returns records newest first and
+    ``key`` turns a record into the cursor for the neighbouring page, so each
+    page costs the same no matter how many threads there are.
+    """
+    def __init__(self, author_id, fetch, key, build_embed):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.fetch = fetch
+        self.key = key
+        self.build_embed = build_embed
+        self.records = []
+    
+    async def load(self, before=None, after=None):
+        # One extra record tells whether there is another page in that direction
+        records = await self.fetch(PAGE_SIZE + 1, before=before, after=after)
+        more = len(records) > PAGE_SIZE
+        if after is not None:
+            self.records = records[-PAGE_SIZE:]
+            self.previous_page.disabled = not more
+            self.next_page.disabled = False
+        else:
+            self.records = records[:PAGE_SIZE]
+            self.previous_page.disabled = before is None
+            self.next_page.disabled = not more
+        return self.build_embed(self.records)
+    
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran this command can change pages.", ephemeral=True)
+            return False
+        return True
+    
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.gray, emoji="◀️")
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load(after=self.key(self.records[0]))
+        await interaction.response.edit_message(embed=embed, view=self)
+    
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.gray, emoji="▶️")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        embed = await self.load(before=self.key(self.records[-1]))
+        await interaction.response.edit_message(embed=embed, view=self)
+
 class Utils(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
     
+    async def cog_load(self):
+        self.bot.add_view(ThreadLogView(bot=self.bot))
+    
+    async def send_thread_list(self, ctx, fetch, key, build_embed, empty_embed):
+        view = ThreadListView(ctx.author.id, fetch, key, build_embed)
+        embed = await view.load()
+        if not view.records:
+            await ctx.send(embed=empty_embed)
+        elif view.next_page.disabled:
+            # Everything fits on one page
+            await ctx.send(embed=embed)
+        else:
+            await ctx.send(embed=embed, view=view)
+    
     @commands.hybrid_group(name="thread", description="Thread management commands")
     @commands.has_permissions(manage_messages=True)
     async def thread_group(self, ctx):
@@ -33,93 +118,150 @@ class Utils(commands.Cog):
     @commands.has_permissions(manage_messages=True)
     async def list_threads(self, ctx):
         """List all active threads"""
-        if not self.bot.threads:
+        async def fetch(limit, before=None, after=None):
+            return page_records(self.bot.threads.values(), created_key, limit, before, after)
+        
+        def build_embed(records):
             embed = discord.Embed(
-                title="No Active Threads",
-                description="There are no active threads.",
-                color=self.bot.config["color"]["warning"]
+                title="Active ModMail Threads",
+                color=self.bot.config["color"]["default"]
             )
-            await ctx.send(embed=embed)
-            return
-        
-        embed = discord.Embed(
-            title="Active ModMail Threads",
-            color=self.bot.config["color"]["default"]
-        )
-        
-        for user_id, thread_data in self.bot.threads.items():
-            user = self.bot.get_user(int(user_id))
-            channel_id = thread_data["channel_id"]
-            channel = self.bot.get_channel(int(channel_id))
-            
-            created_at = datetime.datetime.fromisoformat(thread_data["created_at"])
-            time_diff = datetime.datetime.utcnow() - created_at
             
-            user_name = user.name if user else f"Unknown User ({user_id})"
-            channel_name = channel.mention if channel else f"Unknown Channel ({channel_id})"
+            for record in records:
+                user_id = record.user_id
+                user = self.bot.get_user(user_id)
+                channel_id = record.channel_id
+                channel = self.bot.get_channel(channel_id)
+                
+                created_at = to_datetime(record.created_at)
+                time_diff = datetime.datetime.utcnow() - created_at
+                
+                user_name = user.name if user else f"Unknown User ({user_id})"
+                channel_name = channel.mention if channel else f"Unknown Channel ({channel_id})"
+                
+                embed.add_field(
+                    name=f"{user_name} ({user_id})",
+                    value=f"Channel: {channel_name}\nCreated: {time_diff.days} days, {time_diff.seconds // 3600} hours ago",
+                    inline=False
+                )
             
-            embed.add_field(
-                name=f"{user_name} ({user_id})",
-                value=f"Channel: {channel_name}\nCreated: {time_diff.days} days, {time_diff.seconds // 3600} hours ago",
-                inline=False
-            )
+            embed.set_footer(text=f"{len(self.bot.threads)} active threads")
+            return embed
         
-        await ctx.send(embed=embed)
+        empty_embed = discord.Embed(
+            title="No Active Threads",
+            description="There are no active threads.",
+            color=self.bot.config["color"]["warning"]
+        )
+        await self.send_thread_list(ctx, fetch, created_key, build_embed, empty_embed)
     
     @thread_group.command(name="closed", description="List closed threads")
     @commands.has_permissions(manage_messages=True)
-    async def list_closed_threads(self, ctx):
-        """List closed threads"""
-        if not self.bot.closed_threads:
+    async def list_closed_threads(self, ctx, user_id: str = None):
+        """List closed threads, optionally only those of one user"""
+        if user_id is not None and not user_id.isdigit():
             embed = discord.Embed(
                 title="No Closed Threads",
-                description="There are no closed threads.",
+                description=f"No closed threads found for user ID: {user_id}",
                 color=self.bot.config["color"]["warning"]
             )
             await ctx.send(embed=embed)
             return
         
-        embed = discord.Embed(
-            title="Closed ModMail Threads",
-            color=self.bot.config["color"]["default"]
-        )
+        filter_id = int(user_id) if user_id is not None else None
         
-        # Only show the 25 most recent closed threads to avoid embed field limit
-        sorted_threads = sorted(
-            self.bot.closed_threads.items(),
-            key=lambda x: datetime.datetime.fromisoformat(x[1].get("closed_at", x[1]["created_at"])),
-            reverse=True
-        )[:25]
+        async def fetch(limit, before=None, after=None):
+            return await self.bot.store.fetch_closed_threads(limit, before, after, user_id=filter_id)
         
-        for user_id, thread_data in sorted_threads:
-            user = self.bot.get_user(int(user_id))
-            
-            closed_at = datetime.datetime.fromisoformat(thread_data.get("closed_at", thread_data["created_at"]))
-            time_diff = datetime.datetime.utcnow() - closed_at
+        def build_embed(records):
+            embed = discord.Embed(
+                title="Closed ModMail Threads" if user_id is None else f"Closed ModMail Threads of {user_id}",
+                color=self.bot.config["color"]["default"]
+            )
             
-            user_name = user.name if user else f"Unknown User ({user_id})"
+            for record in records:
+                user = self.bot.get_user(record.user_id)
+                
+                closed_at = to_datetime(record.closed_at)
+                time_diff = datetime.datetime.utcnow() - closed_at
+                
+                user_name = user.name if user else f"Unknown User ({record.user_id})"
+                
+                closed_by = None
+                if record.closed_by:
+                    closed_by = self.bot.get_user(record.closed_by)
+                closed_by_name = closed_by.name if closed_by else "Unknown"
+                
+                embed.add_field(
+                    name=f"{user_name} ({record.user_id})",
+                    value=f"Thread: {record.channel_id}\nClosed by: {closed_by_name}\nClosed: {time_diff.days} days, {time_diff.seconds // 3600} hours ago",
+                    inline=False
+                )
             
-            closed_by_id = thread_data.get("closed_by")
-            closed_by = None
-            if closed_by_id:
-                closed_by = self.bot.get_user(int(closed_by_id))
-            closed_by_name = closed_by.name if closed_by else "Unknown"
-            
-            embed.add_field(
-                name=f"{user_name} ({user_id})",
-                value=f"Closed by: {closed_by_name}\nClosed: {time_diff.days} days, {time_diff.seconds // 3600} hours ago",
-                inline=False
+            return embed
+        
+        empty_embed = discord.Embed(
+            title="No Closed Threads",
+            description="There are no closed threads." if user_id is None else f"No closed threads found for user ID: {user_id}",
+            color=self.bot.config["color"]["warning"]
+        )
+        await self.send_thread_list(ctx, fetch, closed_key, build_embed, empty_embed)
+    
+    @thread_group.command(name="search", description="Search the messages of all threads")
+    @commands.has_permissions(manage_messages=True)
+    async def search_threads(self, ctx, *, query: str):
+        """Search thread messages. Filters: user:<id> from:staff|user after:YYYY-MM-DD before:YYYY-MM-DD"""
+        try:
+            search_query = SearchQuery.parse(query)
+        except ValueError as e:
+            embed = discord.Embed(
+                title="Invalid Search",
+                description=str(e),
+                color=self.bot.config["color"]["error"]
             )
+            await ctx.send(embed=embed)
+            return
         
-        await ctx.send(embed=embed)
+        # Messages relayed in the last moments may still be queued for the index
+        await self.bot.writer.flush()
+        
+        async def fetch(limit, before=None, after=None):
+            return await self.bot.search.search(search_query, limit, before, after)
+        
+        def build_embed(hits):
+            embed = discord.Embed(
+                title="Search Results",
+                description=f"Query: {query}"[:4096],
+                color=self.bot.config["color"]["default"]
+            )
+            
+            for hit in hits:
+                user = self.bot.get_user(hit.user_id)
+                user_name = user.name if user else f"Unknown User ({hit.user_id})"
+                created_at = to_datetime(hit.created_at).strftime("%Y-%m-%d %H:%M UTC")
+                sender = "Staff" if hit.is_staff else "User"
+                
+                embed.add_field(
+                    name=f"{user_name} ({hit.user_id}) - {created_at}"[:256],
+                    value=f"{sender}: {hit.snippet}\nThread: {hit.channel_id}"[:1024],
+                    inline=False
+                )
+            return embed
+        
+        empty_embed = discord.Embed(
+            title="No Results",
+            description=f"No messages found for: {query}"[:4096],
+            color=self.bot.config["color"]["warning"]
+        )
+        await self.send_thread_list(ctx, fetch, hit_key, build_embed, empty_embed)
     
     @thread_group.command(name="info", description="Get information about a thread")
     @commands.has_permissions(manage_messages=True)
     async def thread_info(self, ctx, user_id: str):
         """Get information about a thread"""
-        thread_data = self.bot.threads.get(user_id) or self.bot.closed_threads.get(user_id)
+        record = await self.bot.store.fetch_thread(int(user_id)) if user_id.isdigit() else None
         
-        if not thread_data:
+        if not record:
             embed = discord.Embed(
                 title="Thread Not Found",
                 description=f"No thread found for user ID: {user_id}",
@@ -128,43 +270,35 @@ class Utils(commands.Cog):
             await ctx.send(embed=embed)
             return
         
-        user = None
-        try:
-            user = await self.bot.fetch_user(int(user_id))
-        except discord.HTTPException:
-            pass
+        user = await self.bot.user_resolver.resolve(user_id)
         
         embed = discord.Embed(
             title=f"Thread Info: {user.name if user else 'Unknown User'} ({user_id})",
             color=self.bot.config["color"]["default"]
         )
         
-        created_at = datetime.datetime.fromisoformat(thread_data["created_at"])
+        created_at = to_datetime(record.created_at)
         
         # Get channel info
-        channel_id = thread_data["channel_id"]
-        channel = self.bot.get_channel(int(channel_id))
+        channel_id = record.channel_id
+        channel = self.bot.get_channel(channel_id)
         channel_status = f"{channel.mention} (active)" if channel else f"Not found ({channel_id})"
         
         # Thread status
-        status = "Active" if user_id in self.bot.threads else "Closed"
+        status = "Closed" if record.is_closed else "Active"
         
         # Additional closed info
         closed_info = ""
-        if status == "Closed" and "closed_at" in thread_data:
-            closed_at = datetime.datetime.fromisoformat(thread_data["closed_at"])
-            closed_by_id = thread_data.get("closed_by")
+        if record.is_closed:
+            closed_at = to_datetime(record.closed_at)
             closed_by = None
-            if closed_by_id:
-                try:
-                    closed_by = await self.bot.fetch_user(int(closed_by_id))
-                except discord.HTTPException:
-                    pass
+            if record.closed_by:
+                closed_by = await self.bot.user_resolver.resolve(record.closed_by)
             
             closed_info = f"\nClosed at: {closed_at.strftime('%Y-%m-%d %H:%M:%S UTC')}\nClosed by: {closed_by.name if closed_by else 'Unknown'}"
         
         # Message count
-        message_count = len(thread_data.get("messages", []))
+        message_count = record.message_count
         
         embed.add_field(name="User", value=f"{user.mention if user else 'Unknown'} ({user_id})", inline=False)
         embed.add_field(name="Status", value=status, inline=True)
@@ -175,77 +309,78 @@ class Utils(commands.Cog):
         if closed_info:
             embed.add_field(name="Closure Info", value=closed_info, inline=False)
         
+        # Earlier tickets of the same user
+        history = await self.bot.store.fetch_closed_threads(limit=6, user_id=record.user_id)
+        past_threads = [past for past in history if past.channel_id != record.channel_id][:5]
+        if past_threads:
+            lines = [
+                f"{to_datetime(past.closed_at).strftime('%Y-%m-%d %H:%M UTC')} - {past.message_count} messages ({past.channel_id})"
+                for past in past_threads
+            ]
+            embed.add_field(name="Previous Threads", value="\n".join(lines), inline=False)
+        
         # Thumbnail
         if user and user.avatar:
             embed.set_thumbnail(url=user.avatar.url)
         
-        view = ThreadLogView(thread_id=user_id, bot=self.bot)
+        # Lets the export button find the thread after a restart
+        embed.set_footer(text=f"User ID: {record.user_id}")
+        
+        view = ThreadLogView(thread_id=record.user_id, bot=self.bot)
         await ctx.send(embed=embed, view=view)
     
     async def export_thread(self, interaction, thread_id):
-        thread_data = self.bot.threads.get(thread_id) or self.bot.closed_threads.get(thread_id)
+        record = await self.bot.store.fetch_thread(thread_id)
         
-        if not thread_data:
+        # Errors are answered before deferring; a followup can't be made
+        # ephemeral once the deferred response is public
+        if not record:
             await interaction.response.send_message(
                 "Thread not found. It may have been deleted.",
                 ephemeral=True
             )
             return
         
-        user = None
-        try:
-            user = await self.bot.fetch_user(int(thread_id))
-        except discord.HTTPException:
-            pass
-        
-        user_name = user.name if user else f"Unknown_{thread_id}"
-        
-        # Create transcript
-        messages = thread_data.get("messages", [])
-        
-        if not messages:
+        if not record.message_count:
             await interaction.response.send_message(
                 "This thread has no messages to export.",
                 ephemeral=True
             )
             return
         
-        transcript_text = f"# ModMail Thread Transcript\n\n"
-        transcript_text += f"User: {user_name} ({thread_id})\n"
-        transcript_text += f"Created: {thread_data['created_at']}\n"
-        
-        if "closed_at" in thread_data:
-            transcript_text += f"Closed: {thread_data['closed_at']}\n"
+        # Loading and rendering a long thread can take longer than the 3 seconds
+        # Discord allows before an interaction must be answered
+        await interaction.response.defer(thinking=True)
         
-        transcript_text += f"Total Messages: {len(messages)}\n\n"
-        transcript_text += "---\n\n"
+        user = await self.bot.user_resolver.resolve(thread_id)
+        user_name = user.name if user else f"Unknown_{thread_id}"
+        stem = f"transcript_{user_name}_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
         
-        for msg in messages:
-            author_id = msg.get("author_id", "unknown")
-            is_staff = msg.get("is_staff", False)
-            
-            try:
-                author = await self.bot.fetch_user(int(author_id))
-                author_name = f"{author.name} {'(Staff)' if is_staff else ''}"
-            except:
-                author_name = f"Unknown User ({author_id}) {'(Staff)' if is_staff else ''}"
-            
-            created_at = datetime.datetime.fromisoformat(msg.get("created_at", datetime.datetime.utcnow().isoformat()))
-            content = msg.get("content", "[No content]")
+        limit = transcript_limit(interaction.channel)
+        if record.is_closed:
+            # Rendered when the thread closed; usually only the upload is left
+            parts, attachments = await self.bot.closed_transcript_parts(record, stem, limit)
+        else:
+            # Active threads still change, so they are rendered on demand
+            messages, names, attachments = await self.bot.load_transcript_data(record)
             
-            transcript_text += f"## {author_name} - {created_at.strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n"
-            transcript_text += f"{content}\n\n"
-            transcript_text += "---\n\n"
-        
-        # Create file and send
-        file = discord.File(
-            io.StringIO(transcript_text),
-            filename=f"transcript_{user_name}_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.md"
-        )
+            # Stream the transcript into spooled files off the event loop
+            parts = await asyncio.get_running_loop().run_in_executor(
+                None,
+                write_transcript,
+                render_markdown(thread_id, record, messages, names),
+                f"{stem}.md",
+                limit,
+                self.bot.config.get("compress_transcripts", False)
+            )
         
-        await interaction.response.send_message(
-            "Here's the transcript of the thread:",
-            file=file
+        await send_transcript(
+            interaction.followup.send,
+            parts,
+            attachments,
+            self.bot.attachments.open_cached,
+            limit,
+            content="Here's the transcript of the thread:"
         )
     
     @commands.hybrid_command(name="ping", description="Check the bot's latency")
@@ -289,8 +424,9 @@ class Utils(commands.Cog):
         if await self._check_staff_perms(ctx):
             staff_cmds = [
                 f"`{prefix}thread list` - List all active threads",
-                f"`{prefix}thread closed` - List closed threads",
-                f"`{prefix}thread info [user_id]` - Get thread info"
+                f"`{prefix}thread closed [user_id]` - List closed threads",
+                f"`{prefix}thread info [user_id]` - Get thread info",
+                f"`{prefix}thread search <query>` - Search thread messages"
             ]
             embed.add_field(name="Staff Commands", value="\n".join(staff_cmds), inline=False)
         
@@ -306,7 +442,10 @@ class Utils(commands.Cog):
                 f"`{prefix}config add_staff [role_id]` - Add staff role",
                 f"`{prefix}config remove_staff [role_id]` - Remove staff role", 
                 f"`{prefix}config unblock [user_id]` - Unblock a user",
-                f"`{prefix}config close_time [hours]` - Set thread auto-close time"
+                f"`{prefix}config close_time [hours]` - Set thread auto-close time",
+                f"`{prefix}config archive_category [id]` - Set archive category for closed threads",
+                f"`{prefix}config archive_retention [hours]` - Delete closed thread channels after this long",
+                f"`{prefix}config watchdog [on/off] [seconds]` - Toggle the event loop watchdog"
             ]
             embed.add_field(name="Admin Commands", value="\n".join(admin_cmds), inline=False)
         
@@ -318,8 +457,7 @@ class Utils(commands.Cog):
             return False
             
         # Check if the member has any of the staff roles
-        staff_roles = self.bot.config.get("staff_roles", [])
-        return any(str(role.id) in staff_roles for role in ctx.author.roles)
+        return self.bot.permissions.is_staff(ctx.author)
 
 async def setup(bot):
     await bot.add_cog(Utils(bot))
\ No newline at end of file
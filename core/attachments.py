@@ -0,0 +1,339 @@
+import asyncio
+import collections
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+
+import aiohttp
+import discord
+
+logger = logging.getLogger("ModmailBot")
+
+# Upload limit for DMs and unboosted guilds
+DEFAULT_UPLOAD_LIMIT = 25 * 1024 * 1024
+
+
+def upload_limit(destination):
+    """Return the upload limit in bytes for a channel or user."""
+    guild = getattr(destination, "guild", None)
+    if guild is not None:
+        return guild.filesize_limit
+    return DEFAULT_UPLOAD_LIMIT
+
+
+def close_file(file):
+    # File.close() only restores the real close() for file objects
+    file.close()
+    file.fp.close()
+
+
+# Discord rejects embeds over these limits with a 400
+EMBED_FIELD_LIMIT = 1024
+EMBED_TOTAL_LIMIT = 6000
+EMBED_MAX_FIELDS = 25
+
+# Longest attachment line kept as a link; longer ones drop the URL
+MAX_LINK_LINE = 512
+
+
+def attachment_link(index, attachment, reason=None):
+    # Keep spoilered attachments behind a spoiler when relayed as a link
+    label = f"[Attachment {index}]({attachment.url})"
+    if len(label) > MAX_LINK_LINE:
+        label = f"Attachment {index} ({attachment.filename[:100]}, link too long)"
+    if reason:
+        label = f"{label} ({reason})"
+    if attachment.is_spoiler():
+        label = f"||{label}||"
+    return label
+
+
+def add_attachment_fields(embed, attachment_text):
+    """Add the attachment lines of a relayed message to ``embed``.
+
+    Lines are packed into as many "Attachments" fields as needed to keep
+    each under Discord's field limit. Lines that would take the embed past
+    its total size are left out and counted in the footer instead.
+    """
+    # Room is kept for the footer in case some lines don't fit
+    remaining = EMBED_TOTAL_LIMIT - len(embed) - len(f"{len(attachment_text)} more attachments not listed")
+    fields = []
+    listed = 0
+
+    for line in attachment_text:
+        if fields and len(fields[-1][1]) + 1 + len(line) <= EMBED_FIELD_LIMIT:
+            cost = 1 + len(line)
+            if cost > remaining:
+                break
+            fields[-1][1] += "\n" + line
+        else:
+            name = "Attachments" if not fields else "Attachments (continued)"
+            cost = len(name) + len(line)
+            if cost > remaining or len(fields) == EMBED_MAX_FIELDS:
+                break
+            fields.append([name, line])
+        remaining -= cost
+        listed += 1
+
+    for name, value in fields:
+        embed.add_field(name=name, value=value, inline=False)
+    if listed < len(attachment_text):
+        embed.set_footer(text=f"{len(attachment_text) - listed} more attachments not listed")
+
+
+class ByteBudget:
+    """Caps the total number of bytes held by in-flight downloads.
+
+    A single request larger than the whole budget is still let through once
+    nothing else is in flight, so it can never deadlock.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.used == 0 or self.used + size <= self.limit
+            )
+            self.used += size
+
+    async def release(self, size):
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class AttachmentCache:
+    """Content-addressed on-disk cache of attachment bytes.
+
+    Blobs are stored under their SHA-256 digest, so identical files are kept
+    once. An in-memory index tracks blob sizes in least-recently-used order;
+    the oldest blobs are evicted once the cache grows past ``max_bytes``.
+    Blobs are looked up by the digest stored with each message, so only
+    transcript exports hit the cache. Relays always download, since Discord
+    never relays the same attachment twice.
+    """
+
+    def __init__(self, directory="cache/attachments", max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self):
+        # Rebuild the index from disk, oldest first
+        os.makedirs(self.directory, exist_ok=True)
+        blobs = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".part"):
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            blobs.append((stat.st_atime, entry.name, stat.st_size))
+
+        self._entries.clear()
+        self.size = 0
+        for _, digest, size in sorted(blobs):
+            self._entries[digest] = size
+            self.size += size
+        self._evict()
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def get(self, digest):
+        """Return the blob path for ``digest`` if cached, marking it as recently used."""
+        if digest is not None and digest in self._entries:
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return self.path(digest)
+        self.misses += 1
+        return None
+
+    def temp_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".part", delete=False)
+
+    def add(self, temp_path, digest, size):
+        """Move a fully written temp file into the cache under its digest."""
+        if digest in self._entries:
+            # Same bytes are already cached
+            os.remove(temp_path)
+            self._entries.move_to_end(digest)
+        else:
+            os.replace(temp_path, self.path(digest))
+            self._entries[digest] = size
+            self.size += size
+
+        self._evict(keep=digest)
+        return self.path(digest)
+
+    def _evict(self, keep=None):
+        while self.size > self.max_bytes and self._entries:
+            digest, size = next(iter(self._entries.items()))
+            if digest == keep:
+                break
+            del self._entries[digest]
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(digest))
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class AttachmentForwarder:
+    """Downloads attachments concurrently for relaying.
+
+    Attachments are streamed in chunks straight into the attachment cache,
+    so only one chunk per download is held in memory, and the bytes of all
+    in-flight downloads are capped by a shared budget. The cached copies are
+    what transcript exports bundle later. Attachments that cannot be
+    uploaded to the destination are never downloaded; they are relayed as
+    links instead.
+    """
+
+    def __init__(self, cache, max_inflight_bytes=64 * 1024 * 1024, chunk_size=64 * 1024):
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.budget = ByteBudget(max_inflight_bytes)
+        self._session = None
+
+        self.downloaded_bytes = 0
+        self.relayed_bytes = 0
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def _download(self, attachment):
+        # Returns the cached blob path and digest
+        sha256 = hashlib.sha256()
+        temp = self.cache.temp_file()
+        try:
+            with temp:
+                async with self._get_session().get(attachment.url) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(self.chunk_size):
+                        sha256.update(chunk)
+                        temp.write(chunk)
+                        self.downloaded_bytes += len(chunk)
+        except BaseException:
+            os.remove(temp.name)
+            raise
+
+        digest = sha256.hexdigest()
+        return self.cache.add(temp.name, digest, attachment.size), digest
+
+    async def _fetch(self, attachment):
+        path, digest = await self._download(attachment)
+        file = discord.File(
+            open(path, "rb"),
+            filename=attachment.filename,
+            spoiler=attachment.is_spoiler(),
+            description=attachment.description
+        )
+        return file, digest
+
+    def open_cached(self, record):
+        """Return a ``discord.File`` for a stored attachment record if it is cached."""
+        path = self.cache.get(record.get("digest"))
+        if path is None:
+            return None
+        try:
+            return discord.File(path, filename=record["filename"])
+        except OSError:
+            return None
+
+    @contextlib.asynccontextmanager
+    async def prepare(self, attachments, destination):
+        """Yield ``(files, attachment_text, records)`` for relaying to ``destination``.
+
+        ``records`` describes each attachment for the thread history, including
+        the content digest of those that were downloaded.
+
+        The message's downloads are reserved from the byte budget in one
+        step, before any of them starts, and held until the block exits, i.e.
+        until the message carrying the files has been sent. Reserving them one
+        by one could leave several messages each holding part of the budget
+        while waiting for the rest.
+        """
+        limit = upload_limit(destination)
+        attachment_text = [None] * len(attachments)
+        records = [
+            {
+                "filename": attachment.filename,
+                "url": attachment.url,
+                "size": attachment.size,
+                "digest": None
+            }
+            for attachment in attachments
+        ]
+        to_fetch = []
+        total = 0
+
+        for i, attachment in enumerate(attachments):
+            # Files that would push the request over the limit go as links
+            if total + attachment.size > limit:
+                attachment_text[i] = attachment_link(i + 1, attachment, "too large to upload")
+            else:
+                total += attachment.size
+                to_fetch.append(i)
+
+        # A message larger than the whole budget takes all of it
+        reserved = min(total, self.budget.limit)
+        await self.budget.acquire(reserved)
+        try:
+            results = await asyncio.gather(
+                *(self._fetch(attachments[i]) for i in to_fetch),
+                return_exceptions=True
+            )
+
+            files = []
+            relayed = 0
+            for i, result in zip(to_fetch, results):
+                if isinstance(result, BaseException):
+                    logger.warning(f"Failed to download attachment {attachments[i].id}: {result}")
+                    attachment_text[i] = attachment_link(i + 1, attachments[i], "could not be downloaded")
+                else:
+                    file, records[i]["digest"] = result
+                    files.append(file)
+                    relayed += attachments[i].size
+                    attachment_text[i] = f"[Attachment {i + 1}]"
+
+            try:
+                yield files, attachment_text, records
+                self.relayed_bytes += relayed
+            finally:
+                for file in files:
+                    close_file(file)
+        finally:
+            await self.budget.release(reserved)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import logging
+
+import discord
+
+logger = logging.getLogger("ModmailBot")
+
+# Marks pool channels so they are found again after a restart
+POOL_TOPIC = "ModMail channel pool (unused)"
+
+
+class ChannelPool:
+    """Hidden thread channels created ahead of time.
+
+    Creating a channel is the slowest and most rate-limited step of opening
+    a thread, so a few are kept ready and :meth:`claim` hands one out
+    without a round trip. A background task tops the pool back up to
+    ``size`` after every claim, one channel at a time.
+
+    ``create()`` makes a new pool channel (or returns None when it can't,
+    e.g. before ModMail is configured), ``get_channel(channel_id)`` looks
+    one up, returning None if it no longer exists, and ``delete(channel)``
+    removes one the pool no longer wants. Unusable and surplus channels are
+    deleted by the same background task.
+    """
+
+    def __init__(self, create, get_channel, delete, size=3, retry_base=5.0, retry_max=300.0):
+        self.create = create
+        self.get_channel = get_channel
+        self.delete = delete
+        self.size = size
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._channels = collections.deque()
+        self._surplus = []
+        self._wanted = asyncio.Event()
+        self._task = None
+
+        self.claimed = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._channels)
+
+    def adopt(self, channel_ids):
+        # Pool channels left over from the previous run
+        for channel_id in channel_ids:
+            if channel_id not in self._channels:
+                self._channels.append(channel_id)
+
+    def claim(self, is_usable=None):
+        """Take a channel from the pool, or return None if none is ready."""
+        while self._channels:
+            channel = self.get_channel(self._channels.popleft())
+            if channel is None:
+                continue
+            if is_usable is None or is_usable(channel):
+                self.claimed += 1
+                self._wanted.set()
+                return channel
+            self.discard(channel)
+
+        self.misses += 1
+        self._wanted.set()
+        return None
+
+    def discard(self, channel):
+        """Delete a channel taken from the pool in the background."""
+        self._surplus.append(channel)
+        self._wanted.set()
+
+    def resize(self, size):
+        self.size = size
+        while len(self._channels) > size:
+            channel = self.get_channel(self._channels.pop())
+            if channel is not None:
+                self.discard(channel)
+        self._wanted.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wanted.set()
+            self._task = asyncio.create_task(self._run(), name="channel-pool")
+
+    async def _run(self):
+        failures = 0
+        while True:
+            await self._wanted.wait()
+            self._wanted.clear()
+
+            while self._surplus:
+                channel = self._surplus.pop()
+                try:
+                    await self.delete(channel)
+                except discord.HTTPException as e:
+                    logger.warning(f"Failed to delete pool channel {channel.id}: {e}")
+
+            while len(self._channels) < self.size:
+                try:
+                    channel = await self.create()
+                except discord.HTTPException as e:
+                    failures += 1
+                    delay = min(self.retry_max, self.retry_base * 2 ** (failures - 1))
+                    logger.warning(f"Failed to create a pool channel: {e}. Retrying in {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                    continue
+
+                if channel is None:
+                    break
+                failures = 0
+                self._channels.append(channel.id)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
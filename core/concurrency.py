@@ -0,0 +1,33 @@
+import asyncio
+import contextlib
+
+
+class KeyedLock:
+    """A set of asyncio locks created on demand, one per key.
+    
+    Locks are dropped again once nobody holds or waits on them, so the map
+    only ever contains keys with work in flight. Waiters are woken in the
+    order they arrived.
+    """
+    
+    def __init__(self):
+        self._locks = {}
+    
+    def locked(self, key):
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+    
+    @contextlib.asynccontextmanager
+    async def __call__(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
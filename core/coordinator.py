@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from core.sqlite import ThreadConnections
+
+logger = logging.getLogger("ModmailBot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    key TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+
+_MISSING = object()
+
+
+def merge_config(base, ours, theirs):
+    """Three-way merge of two configs that both started out as ``base``.
+
+    A key changed on one side only takes that side's value. When both sides
+    changed a list, such as the blocklist, entries added or removed on
+    either side are all kept; any other key changed on both sides takes
+    ``ours``.
+    """
+    merged = {}
+    for key in {**theirs, **ours}:
+        b, o, t = (config.get(key, _MISSING) for config in (base, ours, theirs))
+        if o == b:
+            value = t
+        elif t == b or t == o:
+            value = o
+        elif isinstance(b, list) and isinstance(o, list) and isinstance(t, list):
+            value = [item for item in t if item in o or item not in b]
+            value += [item for item in o if item not in b and item not in t]
+        else:
+            value = o
+        if value is not _MISSING:
+            merged[key] = value
+    return merged
+
+
+class StateCoordinator:
+    """State shared by every bot process, and change notifications between them.
+
+    The shared config lives in a SQLite database that all processes open in
+    WAL mode. Whenever a process changes shared state it appends an
+    invalidation ``(topic, key)`` to a log table; every other process polls
+    the log and runs the callbacks subscribed to that topic, which reload
+    whatever the key names. Invalidations seen in the same poll are
+    coalesced, and a process never receives its own.
+
+    ``config_base`` is the shared config as this process last loaded or
+    saved it. Saves merge the changes made since then into the stored
+    config under the database write lock (see :func:`merge_config`), so a
+    change another process saved in the meantime is never overwritten.
+
+    The interface is publish/subscribe on topics so another transport, such
+    as Redis pub/sub, can take the place of the polled table.
+    """
+
+    def __init__(self, path="shared.db", interval=0.25, retention=300):
+        self.path = path
+        self.interval = interval
+        self.retention = retention
+        self.node_id = uuid.uuid4().hex
+        self._subscribers = {}
+        self._last_id = 0
+        self._last_prune = 0.0
+        self.config_base = {}
+        self._connections = ThreadConnections(path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coordinator")
+        self._task = None
+
+    def open(self):
+        conn = self._connections.get()
+        conn.executescript(SCHEMA)
+        # Only changes made from now on are relevant; current state is loaded separately
+        self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations").fetchone()[0]
+
+    def subscribe(self, topic, callback):
+        """Run ``await callback(key)`` when another process invalidates ``topic``."""
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def _insert(self, conn, topic, keys):
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO invalidations (origin, topic, key, created_at) VALUES (?, ?, ?, ?)",
+            [(self.node_id, topic, None if key is None else str(key), now) for key in keys]
+        )
+
+    def publish(self, topic, keys=(None,)):
+        # Safe to call from any thread, e.g. the persistence writer's executor
+        conn = self._connections.get()
+        with conn:
+            self._insert(conn, topic, keys)
+
+    def load_config(self):
+        row = self._connections.get().execute("SELECT value FROM settings WHERE name = 'config'").fetchone()
+        if row is None:
+            return None
+        self.config_base = json.loads(row[0])
+        return json.loads(row[0])
+
+    def save_config(self, config):
+        """Merge this process's changes into the shared config. Returns the stored config."""
+        base = self.config_base
+        conn = self._connections.get()
+        with conn:
+            # Taking the write lock up front keeps the read and the write atomic
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM settings WHERE name = 'config'").fetchone()
+            merged = merge_config(base, config, json.loads(row[0])) if row else config
+            value = json.dumps(merged)
+            conn.execute(
+                "INSERT INTO settings (name, value) VALUES ('config', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                (value,)
+            )
+            self._insert(conn, "config", (None,))
+        self.config_base = json.loads(value)
+        return merged
+
+    def _read(self):
+        conn = self._connections.get()
+        rows = conn.execute(
+            "SELECT id, origin, topic, key FROM invalidations WHERE id > ? ORDER BY id",
+            (self._last_id,)
+        ).fetchall()
+        if rows:
+            self._last_id = rows[-1][0]
+
+        now = time.time()
+        if now - self._last_prune > self.retention:
+            self._last_prune = now
+            with conn:
+                conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - self.retention,))
+
+        # Keep the first occurrence of each (topic, key), in order
+        changes = {}
+        for _, origin, topic, key in rows:
+            if origin != self.node_id:
+                changes.setdefault((topic, key), None)
+        return list(changes)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="state-coordinator")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                changes = await loop.run_in_executor(self._executor, self._read)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to read shared state changes: {e}")
+                changes = []
+
+            for topic, key in changes:
+                for callback in self._subscribers.get(topic, ()):
+                    try:
+                        await callback(key)
+                    except Exception:
+                        logger.exception(f"Failed to apply shared {topic} change {key}")
+
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self._executor.shutdown(wait=True)
+        self._connections.close()
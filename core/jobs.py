@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import discord
+
+from core.scheduler import DeadlineScheduler
+from core.sqlite import ThreadConnections
+
+logger = logging.getLogger("ModmailBot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT,
+    payload TEXT NOT NULL,
+    run_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+# Created separately so queues from before keyed jobs can be migrated first
+KEY_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key)"
+
+
+def is_transient(error):
+    """Whether a failed job is worth retrying: rate limits, server errors and network trouble."""
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+class JobQueue:
+    """Durable background jobs, stored in SQLite.
+
+    A job is a ``kind`` and a JSON payload, handled by the async callable
+    registered for that kind. Jobs are written to disk before
+    :meth:`enqueue` returns and deleted once their handler succeeds, so
+    jobs that were pending when the bot stopped run again after
+    :meth:`start`. A job enqueued with a ``key`` is merged into the pending
+    job with the same key instead of being added next to it, which
+    coalesces repeated updates of one resource. Transient failures (see :func:`is_transient`) are
+    retried with exponential backoff and jitter; anything else, or running
+    out of attempts, drops the job with an error in the log.
+
+    Running jobs are leased with ``locked_until``, so several processes can
+    share one queue without running a job twice.
+    """
+
+    def __init__(self, path="jobs.db", concurrency=2, max_attempts=8, retry_base=5.0, retry_max=3600.0, lease=300.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self._handlers = {}
+        self._jobs = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._scheduler = DeadlineScheduler(self._run_job)
+        self._connections = ThreadConnections(path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+
+    def __len__(self):
+        return len(self._jobs)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def register(self, kind, handler):
+        """Handle jobs of ``kind`` with ``await handler(payload)``."""
+        self._handlers[kind] = handler
+
+    def open(self):
+        conn = self._connections.get()
+        conn.executescript(SCHEMA)
+
+        # Queues created before keyed jobs
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "key" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN key TEXT")
+        conn.execute(KEY_INDEX)
+
+    def _load(self):
+        return self._connections.get().execute("SELECT id, kind, payload, run_at, attempts FROM jobs").fetchall()
+
+    async def start(self):
+        # Pick up jobs left over from the previous run
+        for job_id, kind, payload, run_at, attempts in await self._run(self._load):
+            self._jobs[job_id] = (kind, json.loads(payload), attempts)
+            self._scheduler.schedule(job_id, run_at)
+        if self._jobs:
+            logger.info(f"Resuming {len(self._jobs)} pending background jobs")
+        self._scheduler.start()
+
+    def _insert(self, kind, payload, run_at, key):
+        conn = self._connections.get()
+        with conn:
+            row = None
+            if key is not None:
+                row = conn.execute("SELECT id, payload, run_at FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                cursor = conn.execute(
+                    "INSERT INTO jobs (kind, key, payload, run_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, key, json.dumps(payload), run_at, time.time())
+                )
+                return cursor.lastrowid, payload, run_at
+
+            # Newer fields win and the job runs no earlier than either request asked;
+            # clearing the lease makes a job that is running now run again afterwards
+            job_id, pending, pending_run_at = row
+            payload = {**json.loads(pending), **payload}
+            run_at = max(run_at, pending_run_at)
+            conn.execute(
+                "UPDATE jobs SET kind = ?, payload = ?, run_at = ?, locked_until = 0 WHERE id = ?",
+                (kind, json.dumps(payload), run_at, job_id)
+            )
+            return job_id, payload, run_at
+
+    async def enqueue(self, kind, payload, delay=0, key=None):
+        """Store a job and schedule it to run after ``delay`` seconds. Returns its ID.
+
+        With a ``key``, a pending job with the same key is updated with the
+        fields of ``payload`` instead, keeping the later of the two run times.
+        """
+        if kind not in self._handlers:
+            raise KeyError(f"Unknown job kind: {kind}")
+        job_id, payload, run_at = await self._run(self._insert, kind, payload, time.time() + delay, key)
+        attempts = self._jobs[job_id][2] if job_id in self._jobs else 0
+        self._jobs[job_id] = (kind, payload, attempts)
+        self._scheduler.schedule(job_id, run_at)
+        return job_id
+
+    def _delete_key(self, key):
+        conn = self._connections.get()
+        with conn:
+            job_ids = [row[0] for row in conn.execute("SELECT id FROM jobs WHERE key = ?", (key,))]
+            conn.execute("DELETE FROM jobs WHERE key = ?", (key,))
+        return job_ids
+
+    async def cancel(self, key):
+        """Drop the pending job with ``key``, if there is one."""
+        for job_id in await self._run(self._delete_key, key):
+            self._jobs.pop(job_id, None)
+            self._scheduler.cancel(job_id)
+
+    def _claim(self, job_id):
+        # Another process sharing the queue may already be running it;
+        # None means the job is gone altogether
+        now = time.time()
+        conn = self._connections.get()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET locked_until = ? WHERE id = ? AND locked_until < ?",
+                (now + self.lease, job_id, now)
+            )
+            if cursor.rowcount == 1:
+                return True
+            if conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is None:
+                return None
+        return False
+
+    def _finish(self, job_id):
+        # A job updated while it ran has lost its lease and is kept for another run
+        conn = self._connections.get()
+        with conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE id = ? AND locked_until > 0", (job_id,))
+        return cursor.rowcount == 1
+
+    def _retry_later(self, job_id, run_at, attempts, error):
+        conn = self._connections.get()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET run_at = ?, attempts = ?, locked_until = 0, last_error = ? WHERE id = ?",
+                (run_at, attempts, error, job_id)
+            )
+
+    def backoff(self, attempts):
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _run_job(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        kind, payload, attempts = job
+        if kind not in self._handlers:
+            # Kept on disk for a later run that registers the handler
+            logger.warning(f"No handler for job {kind} #{job_id}, leaving it queued")
+            del self._jobs[job_id]
+            return
+
+        async with self._semaphore:
+            claimed = await self._run(self._claim, job_id)
+            if claimed is None:
+                self._jobs.pop(job_id, None)
+                return
+            if not claimed:
+                # Leased elsewhere; check again once the lease runs out
+                self._scheduler.schedule(job_id, time.time() + self.lease)
+                return
+
+            try:
+                await self._handlers[kind](payload)
+            except Exception as e:
+                attempts += 1
+                if is_transient(e) and attempts < self.max_attempts:
+                    run_at = time.time() + self.backoff(attempts)
+                    logger.warning(f"Job {kind} #{job_id} failed ({e}), retry {attempts} in {run_at - time.time():.0f}s")
+                    # The payload may have been updated while the job ran
+                    kind, payload, _ = self._jobs.get(job_id, job)
+                    self._jobs[job_id] = (kind, payload, attempts)
+                    await self._run(self._retry_later, job_id, run_at, attempts, str(e))
+                    self._scheduler.schedule(job_id, run_at)
+                    return
+                logger.error(f"Job {kind} #{job_id} failed permanently after {attempts} attempts: {e}")
+
+            if await self._run(self._finish, job_id):
+                self._jobs.pop(job_id, None)
+
+    async def close(self):
+        # Unfinished jobs stay in the database and run again on the next start
+        await self._scheduler.close()
+        self._executor.shutdown(wait=True)
+        self._connections.close()
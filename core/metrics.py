@@ -0,0 +1,315 @@
+import asyncio
+import bisect
+import logging
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger("ModmailBot")
+
+# Latency buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Payload size buckets in bytes
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 * 1024, 8 * 1024 * 1024, 64 * 1024 * 1024)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}"
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield "", labels, value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        # For totals that another component already counts
+        self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # Per-bucket counts, then sum and count
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield "_bucket", labels + (("le", _format_value(bound)),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text format.
+
+    Collectors are async callables run before each render to refresh gauges
+    that are read from other components rather than updated as events happen.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self._add(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self._add(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    async def render(self):
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collector.__name__} failed: {e}")
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+class RateLimitCounter(logging.Handler):
+    """Counts 429 responses reported by discord.py's HTTP client.
+
+    discord.py retries rate-limited requests itself and only logs them, so
+    the log records are the one place they can be observed.
+    """
+
+    def __init__(self, counter):
+        super().__init__(level=logging.WARNING)
+        self.counter = counter
+
+    def emit(self, record):
+        if "responded with 429" in record.getMessage():
+            self.counter.inc()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed-interval sleep."""
+
+    def __init__(self, histogram, gauge, interval=0.5):
+        self.histogram = histogram
+        self.gauge = gauge
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    async def _run(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started_at - self.interval)
+            self.histogram.observe(lag)
+            self.gauge.set(lag)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class BotMetrics:
+    """The bot's metrics and the optional HTTP endpoint serving them.
+
+    Relay latency, persistence writes and loop lag are recorded as they
+    happen; thread counts, relay queues and the attachment cache are read
+    from their owners on each scrape.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.registry = Registry()
+        registry = self.registry
+
+        self.relay_latency = registry.histogram(
+            "modmail_relay_latency_seconds",
+            "Time from a message being sent to it being relayed, by direction"
+        )
+        self.save_duration = registry.histogram(
+            "modmail_save_duration_seconds",
+            "Time spent writing persisted state, by job"
+        )
+        self.save_bytes = registry.histogram(
+            "modmail_save_bytes",
+            "Bytes written per persistence write, by job",
+            SIZE_BUCKETS
+        )
+        self.save_failures = registry.counter(
+            "modmail_save_failures_total",
+            "Persistence writes that failed, by job"
+        )
+        self.attachment_bytes = registry.counter(
+            "modmail_attachment_bytes_total",
+            "Attachment bytes downloaded from Discord and relayed"
+        )
+        self.rate_limits = registry.counter(
+            "modmail_rate_limits_total",
+            "REST responses with status 429"
+        )
+        self.threads = registry.gauge(
+            "modmail_threads",
+            "Threads in storage, by state"
+        )
+        self.loop_lag = registry.histogram(
+            "modmail_event_loop_lag_seconds",
+            "How late the event loop runs a timer"
+        )
+        self.loop_lag_last = registry.gauge(
+            "modmail_event_loop_lag_last_seconds",
+            "Most recent event loop lag sample"
+        )
+        self.relay_queue = registry.gauge(
+            "modmail_relay_queue",
+            "Relay pipeline state"
+        )
+        self.relay_jobs = registry.counter(
+            "modmail_relay_jobs_total",
+            "Relay jobs by outcome"
+        )
+        self.cache = registry.gauge(
+            "modmail_attachment_cache",
+            "Attachment cache state"
+        )
+        self.cache_lookups = registry.counter(
+            "modmail_attachment_cache_lookups_total",
+            "Attachment cache lookups by result"
+        )
+
+        registry.add_collector(self.collect)
+
+        self.lag_monitor = LoopLagMonitor(self.loop_lag, self.loop_lag_last)
+        self._rate_limit_handler = RateLimitCounter(self.rate_limits)
+        self._runner = None
+
+    def observe_write(self, job, duration, size, failed=False):
+        # Hook for the persistence writer
+        if failed:
+            self.save_failures.inc(job=job)
+            return
+        self.save_duration.observe(duration, job=job)
+        if size is not None:
+            self.save_bytes.observe(size, job=job)
+
+    async def collect(self):
+        bot = self.bot
+        self.threads.set(len(bot.threads), state="active")
+        self.threads.set(await bot.store.fetch_closed_count(), state="closed")
+
+        forwarder = bot.attachments
+        self.attachment_bytes.set_total(forwarder.downloaded_bytes, direction="downloaded")
+        self.attachment_bytes.set_total(forwarder.relayed_bytes, direction="relayed")
+
+        cache = forwarder.cache.stats()
+        self.cache.set(cache["entries"], kind="entries")
+        self.cache.set(cache["bytes"], kind="bytes")
+        self.cache_lookups.set_total(cache["hits"], result="hit")
+        self.cache_lookups.set_total(cache["misses"], result="miss")
+        self.cache_lookups.set_total(cache["evictions"], result="eviction")
+
+        modmail_cog = bot.get_cog("ModMail")
+        if modmail_cog is not None:
+            relay = modmail_cog.relay.stats()
+            for kind in ("threads", "queued", "active", "max_depth"):
+                self.relay_queue.set(relay[kind], kind=kind)
+            for outcome in ("submitted", "completed", "failed"):
+                self.relay_jobs.set_total(relay[outcome], outcome=outcome)
+
+    async def handle_metrics(self, request):
+        body = await self.registry.render()
+        return web.Response(text=body, content_type="text/plain", charset="utf-8")
+
+    async def start(self, host, port):
+        self.lag_monitor.start()
+        logging.getLogger("discord.http").addHandler(self._rate_limit_handler)
+
+        if port is None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self):
+        await self.lag_monitor.close()
+        logging.getLogger("discord.http").removeHandler(self._rate_limit_handler)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,82 @@
+import datetime
+
+
+def to_timestamp(value):
+    """Convert a stored timestamp (epoch seconds or naive UTC ISO string) to epoch seconds."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def to_datetime(timestamp):
+    """Convert epoch seconds to a naive UTC datetime, matching ``datetime.utcnow()``."""
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+
+def to_isoformat(timestamp):
+    return to_datetime(timestamp).isoformat() if timestamp is not None else None
+
+
+def int_or_none(value):
+    return int(value) if value is not None else None
+
+
+def str_or_none(value):
+    return str(value) if value is not None else None
+
+
+class ThreadRecord:
+    """Metadata of a single thread.
+
+    Only IDs, timestamps (epoch seconds) and a message count are kept in
+    memory; message bodies stay in the thread store and are loaded on demand
+    with ``ThreadStore.fetch_messages``.
+    """
+
+    __slots__ = (
+        "user_id",
+        "channel_id",
+        "created_at",
+        "last_activity",
+        "message_count",
+        "closed_at",
+        "closed_by"
+    )
+
+    def __init__(self, user_id, channel_id, created_at, last_activity=None, message_count=0, closed_at=None, closed_by=None):
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.created_at = created_at
+        self.last_activity = last_activity if last_activity is not None else created_at
+        self.message_count = message_count
+        self.closed_at = closed_at
+        self.closed_by = closed_by
+
+    @property
+    def is_closed(self):
+        return self.closed_at is not None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        # Also accepts the old thread dicts with string IDs, ISO timestamps
+        # and an inline message list
+        messages = data.get("messages")
+        last_activity = data.get("last_activity")
+        if last_activity is None and messages:
+            last_activity = messages[-1]["created_at"]
+
+        return cls(
+            user_id=int(data["user_id"]),
+            channel_id=int(data["channel_id"]),
+            created_at=to_timestamp(data["created_at"]),
+            last_activity=to_timestamp(last_activity),
+            message_count=data.get("message_count", len(messages or [])),
+            closed_at=to_timestamp(data.get("closed_at")),
+            closed_by=int_or_none(data.get("closed_by"))
+        )
+
+    def __repr__(self):
+        return f"<ThreadRecord user_id={self.user_id} channel_id={self.channel_id} messages={self.message_count}>"
@@ -0,0 +1,47 @@
+class PermissionModel:
+    """In-memory view of the blocklist and staff roles, derived from config.
+    
+    Config keeps IDs as lists of strings; here they are frozensets of ints so
+    each check is a hash lookup. :meth:`rebuild` must run whenever the config
+    changes, which ``ModMailBot.save_config`` takes care of. Staff checks are
+    additionally cached per member until their roles change.
+    """
+    
+    def __init__(self, max_members=10000):
+        self.max_members = max_members
+        self.blocked_users = frozenset()
+        self.staff_roles = frozenset()
+        self._staff_members = {}
+    
+    def rebuild(self, config):
+        self.blocked_users = _id_set(config.get("blocked_users", []))
+        self.staff_roles = _id_set(config.get("staff_roles", []))
+        self._staff_members.clear()
+    
+    def is_blocked(self, user_id):
+        return int(user_id) in self.blocked_users
+    
+    def is_staff(self, member):
+        key = (getattr(member.guild, "id", None), member.id)
+        cached = self._staff_members.get(key)
+        if cached is not None:
+            return cached
+        
+        is_staff = any(role.id in self.staff_roles for role in getattr(member, "roles", ()))
+        if len(self._staff_members) >= self.max_members:
+            self._staff_members.clear()
+        self._staff_members[key] = is_staff
+        return is_staff
+    
+    def invalidate_member(self, member):
+        self._staff_members.pop((getattr(member.guild, "id", None), member.id), None)
+
+
+def _id_set(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return frozenset(ids)
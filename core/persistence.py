@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("ModmailBot")
+
+
+def atomic_write_json(path, data, indent=4):
+    """Write JSON to a temp file and rename it over the target. Returns the size written."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+class PersistenceWriter:
+    """Background task that turns dirty-state notifications into batched writes.
+    
+    Each registered job has a ``snapshot`` callable, run on the event loop to
+    capture the state to persist, and a ``write`` callable, run in the default
+    executor with that snapshot. Marking a job dirty several times before the
+    next flush results in a single write. Jobs whose snapshot drains a buffer
+    pass a ``restore`` callable that puts the data of a failed write back, so
+    the next flush writes it again.
+    
+    ``on_write(name, duration, size, failed=False)`` is called after every
+    write; ``size`` is whatever byte count the write callable returned.
+    """
+    
+    def __init__(self, delay=0.5, on_write=None):
+        self.delay = delay
+        self.on_write = on_write
+        self._jobs = {}
+        self._dirty = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+    
+    def register(self, name, snapshot, write, restore=None):
+        self._jobs[name] = (snapshot, write, restore)
+    
+    def mark_dirty(self, name):
+        if name not in self._jobs:
+            raise KeyError(f"Unknown persistence job: {name}")
+        self._dirty[name] = None
+        self._wakeup.set()
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="persistence-writer")
+    
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let a burst of changes pile up before writing
+            await asyncio.sleep(self.delay)
+            # Shielded so cancelling the task never abandons a write half-way
+            await asyncio.shield(self.flush())
+    
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        
+        async with self._lock:
+            self._wakeup.clear()
+            dirty = list(self._dirty)
+            self._dirty.clear()
+            
+            for name in dirty:
+                snapshot, write, restore = self._jobs[name]
+                started_at = time.perf_counter()
+                captured = False
+                try:
+                    data = snapshot()
+                    captured = True
+                    size = await loop.run_in_executor(None, write, data)
+                except Exception as e:
+                    logger.error(f"Failed to persist {name}: {e}")
+                    if self.on_write is not None:
+                        self.on_write(name, time.perf_counter() - started_at, None, failed=True)
+                    # Try again on the next flush, with the data that failed
+                    if captured and restore is not None:
+                        restore(data)
+                    self._dirty[name] = None
+                    self._wakeup.set()
+                else:
+                    if self.on_write is not None:
+                        self.on_write(name, time.perf_counter() - started_at, size if isinstance(size, int) else None)
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        # Final flush so a shutdown never loses the last batch
+        await self.flush()
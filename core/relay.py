@@ -0,0 +1,108 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger("ModmailBot")
+
+
+class RelayPipeline:
+    """Ordered relay queues with a global concurrency limit.
+    
+    Jobs submitted under the same key run one at a time in submission order,
+    so messages in a thread are always relayed in the order they arrived.
+    Jobs under different keys run in parallel, but never more than
+    ``max_concurrency`` at once. Once ``max_pending`` jobs are queued,
+    :meth:`submit` waits for room, pushing back on the gateway handlers
+    instead of letting the backlog grow without bound.
+    
+    ``on_job(name, duration)`` is called with the run time of every job.
+    """
+    
+    def __init__(self, max_concurrency=8, max_pending=500, on_job=None):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.on_job = on_job
+        self._queues = {}
+        self._workers = {}
+        self._running = asyncio.Semaphore(max_concurrency)
+        self._capacity = asyncio.Semaphore(max_pending)
+        
+        # Backpressure metrics
+        self.queued = 0
+        self.active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+    
+    async def submit(self, key, func, *args):
+        # Waits here when the pipeline is full
+        await self._capacity.acquire()
+        
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+            self._workers[key] = asyncio.create_task(self._worker(key, queue))
+        
+        queue.append((func, args, time.perf_counter()))
+        self.queued += 1
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, len(queue))
+    
+    async def _worker(self, key, queue):
+        try:
+            # No await between finding the queue empty and removing it, so a
+            # concurrent submit either lands in this queue or starts a new worker
+            while queue:
+                func, args, enqueued_at = queue.popleft()
+                
+                try:
+                    async with self._running:
+                        started_at = time.perf_counter()
+                        self.total_wait += started_at - enqueued_at
+                        self.active += 1
+                        try:
+                            await func(*args)
+                            self.completed += 1
+                        except Exception:
+                            self.failed += 1
+                            logger.exception(f"Relay job for {key} failed")
+                        finally:
+                            self.active -= 1
+                            duration = time.perf_counter() - started_at
+                            self.total_run += duration
+                            if self.on_job is not None:
+                                self.on_job(f"relay {func.__name__}", duration)
+                finally:
+                    self.queued -= 1
+                    self._capacity.release()
+        finally:
+            del self._queues[key]
+            del self._workers[key]
+    
+    def stats(self):
+        finished = self.completed + self.failed
+        return {
+            "threads": len(self._queues),
+            "queued": self.queued,
+            "active": self.active,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_depth": self.max_depth,
+            "avg_wait": self.total_wait / finished if finished else 0.0,
+            "avg_run": self.total_run / finished if finished else 0.0
+        }
+    
+    async def close(self, timeout=10.0):
+        # Let queued relays finish first, so every delivered message is also
+        # recorded before shutdown; whatever is still running after that is cancelled
+        workers = list(self._workers.values())
+        if workers and timeout:
+            await asyncio.wait(workers, timeout=timeout)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger("ModmailBot")
+
+
+class DeadlineScheduler:
+    """Runs a callback for each key once its deadline passes.
+    
+    Deadlines live in a min-heap, so scheduling or rescheduling a key is
+    O(log n) and the timer task only ever sleeps until the earliest deadline.
+    Rescheduled and cancelled keys leave stale heap entries behind; they are
+    skipped when they reach the top and the heap is rebuilt if they pile up.
+    Deadlines are wall-clock timestamps so they can be restored from storage.
+    """
+    
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+    
+    def __len__(self):
+        return len(self._deadlines)
+    
+    def deadline(self, key):
+        return self._deadlines.get(key)
+    
+    def schedule(self, key, when):
+        self._deadlines[key] = when
+        entry = (when, next(self._counter), key)
+        heapq.heappush(self._heap, entry)
+        
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+        
+        # Only wake the timer if this is now the earliest deadline
+        if self._heap[0] is entry:
+            self._wakeup.set()
+    
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+    
+    def clear(self):
+        self._deadlines.clear()
+        self._heap.clear()
+        self._wakeup.set()
+    
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
+    
+    def _is_stale(self, entry):
+        when, _, key = entry
+        return self._deadlines.get(key) != when
+    
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="deadline-scheduler")
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            
+            while self._heap and self._is_stale(self._heap[0]):
+                heapq.heappop(self._heap)
+            
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            
+            when, _, key = self._heap[0]
+            delay = when - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heapq.heappop(self._heap)
+            del self._deadlines[key]
+            
+            task = asyncio.create_task(self._fire(key))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+    
+    async def _fire(self, key):
+        try:
+            await self.callback(key)
+        except Exception:
+            logger.exception(f"Scheduled callback for {key} failed")
+    
+    async def close(self):
+        tasks = list(self._running)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,281 @@
+import asyncio
+import collections
+import datetime
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from core.models import int_or_none, to_timestamp
+from core.sqlite import ThreadConnections
+
+logger = logging.getLogger("ModmailBot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    message_id INTEGER,
+    author_id INTEGER,
+    is_staff INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    content TEXT NOT NULL,
+    UNIQUE (channel_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_documents_user_id ON documents (user_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    content,
+    content='documents',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+    INSERT INTO documents_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+INSERT_DOCUMENT = """
+INSERT OR IGNORE INTO documents (channel_id, user_id, message_id, author_id, is_staff, created_at, content)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+SearchHit = collections.namedtuple(
+    "SearchHit",
+    "id channel_id user_id author_id is_staff created_at snippet score"
+)
+
+
+def hit_key(hit):
+    # Hits are listed best match first, i.e. by descending key
+    return (-hit.score, hit.id)
+
+
+class SearchQuery:
+    """A parsed ``thread search`` query.
+
+    Free text is matched against message content; ``user:<id>``,
+    ``from:staff``/``from:user``, ``after:YYYY-MM-DD`` and
+    ``before:YYYY-MM-DD`` narrow the results.
+    """
+
+    FILTER = re.compile(r"^(user|from|after|before):(\S+)$", re.IGNORECASE)
+
+    def __init__(self, terms, user_id=None, is_staff=None, after=None, before=None):
+        self.terms = terms
+        self.user_id = user_id
+        self.is_staff = is_staff
+        self.after = after
+        self.before = before
+
+    @classmethod
+    def parse(cls, text):
+        """Parse a query string; raises ValueError on a malformed filter."""
+        terms = []
+        filters = {}
+        for word in text.split():
+            match = cls.FILTER.match(word)
+            if not match:
+                terms.append(word)
+                continue
+
+            name, value = match.group(1).lower(), match.group(2)
+            if name == "user":
+                if not value.isdigit():
+                    raise ValueError(f"user: needs a user ID, not '{value}'")
+                filters["user_id"] = int(value)
+            elif name == "from":
+                if value.lower() not in ("staff", "user"):
+                    raise ValueError("from: must be 'staff' or 'user'")
+                filters["is_staff"] = value.lower() == "staff"
+            else:
+                try:
+                    day = datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+                except ValueError:
+                    raise ValueError(f"{name}: needs a date like 2024-01-31, not '{value}'")
+                # after: includes the given day, before: stops short of it
+                filters[name] = day.timestamp()
+
+        if not terms:
+            raise ValueError("Enter at least one word to search for")
+        return cls(terms, **filters)
+
+    def match_expression(self):
+        # Every term must appear; quoting keeps FTS5 operators in user input literal
+        return " ".join('"{}"'.format(term.replace('"', '""')) for term in self.terms)
+
+
+class SearchIndex:
+    """Full-text index over thread messages, in SQLite FTS5.
+
+    Messages and deletes are queued on the event loop with :meth:`add` and
+    :meth:`remove_channels` and applied in batches by the persistence
+    writer through :meth:`drain` and :meth:`write`. Searches run in a
+    dedicated executor. Threads stored before the index existed are added
+    once by :meth:`backfill`.
+    """
+
+    def __init__(self, path="search.db"):
+        self.path = path
+        self._buffer = []
+        self._backfilling = False
+        self._deleted_during_backfill = set()
+        self._connections = ThreadConnections(path)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def open(self):
+        self._connections.get().executescript(SCHEMA)
+
+    @staticmethod
+    def _document(user_id, channel_id, message):
+        content = message.get("content")
+        if not content:
+            return None
+        return (
+            int(channel_id),
+            int(user_id),
+            int_or_none(message.get("message_id")),
+            int_or_none(message.get("author_id")),
+            int(bool(message.get("is_staff", False))),
+            to_timestamp(message["created_at"]),
+            content
+        )
+
+    def add(self, user_id, channel_id, message):
+        document = self._document(user_id, channel_id, message)
+        if document is not None:
+            self._buffer.append(("add", document))
+
+    def remove_channels(self, channel_ids):
+        for channel_id in channel_ids:
+            self._buffer.append(("remove", int(channel_id)))
+            if self._backfilling:
+                self._deleted_during_backfill.add(int(channel_id))
+
+    def drain(self):
+        # Called on the event loop; hands queued changes over to the writer
+        changes = self._buffer
+        self._buffer = []
+        return changes
+
+    def restore(self, changes):
+        # Changes whose write failed go back in front of anything queued since
+        self._buffer[:0] = changes
+
+    def write(self, changes):
+        # Called from the persistence writer's executor thread
+        if not changes:
+            return
+        conn = self._connections.get()
+        with conn:
+            for op, value in changes:
+                if op == "add":
+                    conn.execute(INSERT_DOCUMENT, value)
+                else:
+                    conn.execute("DELETE FROM documents WHERE channel_id = ?", (value,))
+
+    def is_backfilled(self):
+        row = self._connections.get().execute("SELECT value FROM meta WHERE name = 'backfilled'").fetchone()
+        return row is not None
+
+    def _backfill(self, threads, read_messages, batch_size=1000):
+        conn = self._connections.get()
+        batch = []
+        count = 0
+        for user_id, channel_id in threads:
+            for message in read_messages(channel_id):
+                document = self._document(user_id, channel_id, message)
+                if document is None:
+                    continue
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    with conn:
+                        conn.executemany(INSERT_DOCUMENT, batch)
+                    count += len(batch)
+                    batch = []
+        with conn:
+            conn.executemany(INSERT_DOCUMENT, batch)
+            conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('backfilled', '1')")
+        return count + len(batch)
+
+    async def backfill(self, threads, read_messages):
+        """Index the stored messages of ``threads`` (``(user_id, channel_id)`` pairs).
+
+        ``read_messages(channel_id)`` is called in the executor. Messages
+        already in the index are skipped, so an interrupted backfill can
+        simply run again.
+        """
+        self._backfilling = True
+        try:
+            count = await self._run(self._backfill, threads, read_messages)
+        finally:
+            self._backfilling = False
+            # Threads deleted while the backfill was running may have been re-added
+            if self._deleted_during_backfill:
+                self.remove_channels(self._deleted_during_backfill)
+                self._deleted_during_backfill = set()
+        return count
+
+    def _search(self, query, limit, before, after):
+        clauses = ["documents_fts MATCH ?"]
+        params = [query.match_expression()]
+        if query.user_id is not None:
+            clauses.append("documents.user_id = ?")
+            params.append(query.user_id)
+        if query.is_staff is not None:
+            clauses.append("documents.is_staff = ?")
+            params.append(int(query.is_staff))
+        if query.after is not None:
+            clauses.append("documents.created_at >= ?")
+            params.append(query.after)
+        if query.before is not None:
+            clauses.append("documents.created_at < ?")
+            params.append(query.before)
+
+        # bm25 is lower for better matches; cursors compare on the hit_key order
+        cursor, cursor_params, order = "", [], "ASC"
+        if after is not None:
+            cursor, cursor_params, order = "WHERE (-score, id) > (?, ?)", list(after), "DESC"
+        elif before is not None:
+            cursor, cursor_params = "WHERE (-score, id) < (?, ?)", list(before)
+
+        rows = self._connections.get().execute(
+            f"""
+            SELECT * FROM (
+                SELECT documents.id, documents.channel_id, documents.user_id, documents.author_id,
+                    documents.is_staff, documents.created_at,
+                    snippet(documents_fts, 0, '**', '**', '...', 16) AS snippet,
+                    bm25(documents_fts) AS score
+                FROM documents_fts JOIN documents ON documents.id = documents_fts.rowid
+                WHERE {' AND '.join(clauses)}
+            ) {cursor}
+            ORDER BY score {order}, id {'ASC' if order == 'DESC' else 'DESC'}
+            LIMIT ?
+            """,
+            (*params, *cursor_params, limit)
+        ).fetchall()
+        hits = [SearchHit(*row[:4], bool(row[4]), *row[5:]) for row in rows]
+        return hits[::-1] if after is not None else hits
+
+    async def search(self, query, limit=25, before=None, after=None):
+        """Return up to ``limit`` hits for a :class:`SearchQuery`, best match first.
+
+        ``before``/``after`` are :func:`hit_key` cursors of the neighbouring page.
+        """
+        return await self._run(self._search, query, limit, before, after)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._connections.close()
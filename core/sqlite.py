@@ -0,0 +1,41 @@
+import sqlite3
+import threading
+
+
+class ThreadConnections:
+    """One SQLite connection per thread for a database file.
+
+    Every connection runs in WAL mode with ``synchronous=NORMAL``, so a
+    writer never blocks readers in other threads or processes. The stores,
+    job queue, search index and state coordinator all open their databases
+    through this.
+    """
+
+    def __init__(self, path, row_factory=None):
+        self.path = path
+        self.row_factory = row_factory
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        # Callers shut their executors down first, so no thread still uses one
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,984 @@
+import asyncio
+import bisect
+import heapq
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from core.models import ThreadRecord, int_or_none, str_or_none, to_isoformat, to_timestamp
+from core.persistence import atomic_write_json
+from core.sqlite import ThreadConnections
+
+logger = logging.getLogger("ModmailBot")
+
+
+def closed_key(record):
+    """Sort key and page cursor of closed threads."""
+    return (record.closed_at, record.channel_id)
+
+
+def created_key(record):
+    """Sort key and page cursor of active threads."""
+    return (record.created_at, record.channel_id)
+
+
+def _slice_page(keys, limit, before=None, after=None):
+    # ``keys`` is sorted oldest first; returns the page newest first
+    if after is not None:
+        start = bisect.bisect_right(keys, tuple(after))
+        return keys[start:start + limit][::-1]
+    end = len(keys) if before is None else bisect.bisect_left(keys, tuple(before))
+    return keys[max(0, end - limit):end][::-1]
+
+
+def page_records(records, key, limit, before=None, after=None):
+    """Return a page of up to ``limit`` records, newest first, from an unsorted iterable.
+
+    ``before`` and ``after`` are cursors (values of ``key``) of the last and
+    first record of the neighbouring page. Costs O(n log limit).
+    """
+    if after is not None:
+        after = tuple(after)
+        page = heapq.nsmallest(limit, (record for record in records if key(record) > after), key=key)
+        return page[::-1]
+    if before is not None:
+        before = tuple(before)
+        records = (record for record in records if key(record) < before)
+    return heapq.nlargest(limit, records, key=key)
+
+
+class ClosedThreads:
+    """Closed thread records keyed by their channel ID.
+
+    Every thread a user opens has its own channel, so reopened tickets never
+    overwrite earlier ones. A per-user history and a global index, both
+    sorted by close time, let listings read a page without scanning every
+    closed thread.
+    """
+
+    def __init__(self):
+        self.by_channel = {}
+        self.by_user = {}
+        self._order = []
+
+    def __len__(self):
+        return len(self.by_channel)
+
+    def __contains__(self, channel_id):
+        return channel_id in self.by_channel
+
+    def get(self, channel_id):
+        return self.by_channel.get(channel_id)
+
+    def values(self):
+        return self.by_channel.values()
+
+    def add(self, record):
+        self.by_channel[record.channel_id] = record
+        history = self.by_user.setdefault(record.user_id, [])
+        history.append(record)
+        if len(history) > 1 and closed_key(history[-2]) > closed_key(record):
+            # Only happens while loading out of order
+            history.sort(key=closed_key)
+
+        # Threads are closed in time order, so this is almost always an append
+        key = closed_key(record)
+        if self._order and self._order[-1] > key:
+            bisect.insort(self._order, key)
+        else:
+            self._order.append(key)
+
+    def remove(self, channel_id):
+        record = self.by_channel.pop(channel_id, None)
+        if record is not None:
+            history = self.by_user[record.user_id]
+            history.remove(record)
+            if not history:
+                del self.by_user[record.user_id]
+            del self._order[bisect.bisect_left(self._order, closed_key(record))]
+        return record
+
+    def remove_user(self, user_id):
+        history = list(self.by_user.get(user_id, []))
+        for record in history:
+            self.remove(record.channel_id)
+        return history
+
+    def history(self, user_id):
+        """Return a user's closed threads, oldest first."""
+        return self.by_user.get(user_id, [])
+
+    def latest(self, user_id):
+        history = self.by_user.get(user_id)
+        return history[-1] if history else None
+
+    def page(self, limit, before=None, after=None, user_id=None):
+        """Return up to ``limit`` records, most recently closed first.
+
+        ``before`` and ``after`` are :func:`closed_key` cursors; a page costs
+        O(log n + limit).
+        """
+        if user_id is None:
+            keys = self._order
+        else:
+            keys = [closed_key(record) for record in self.history(user_id)]
+        return [self.by_channel[channel_id] for _, channel_id in _slice_page(keys, limit, before, after)]
+
+
+def apply_event(active, closed, channels, event):
+    """Apply a single thread event to the active/closed thread records.
+
+    ``channels`` is the channel ID -> user ID index of active threads and is
+    kept in step with ``active``. ``closed`` is a :class:`ClosedThreads`, or
+    None for backends that keep closed threads out of memory.
+    """
+    op = event["op"]
+    user_id = int_or_none(event.get("user_id"))
+
+    if op == "open":
+        record = ThreadRecord.from_dict(event["thread"])
+        previous = active.get(record.user_id)
+        if previous is not None:
+            channels.pop(previous.channel_id, None)
+        active[record.user_id] = record
+        channels[record.channel_id] = record.user_id
+    elif op == "message":
+        record = active.get(user_id)
+        if record is not None:
+            record.message_count += 1
+            if "at" in event:
+                record.last_activity = event["at"]
+            else:
+                record.last_activity = to_timestamp(event["message"]["created_at"])
+    elif op == "close":
+        record = active.pop(user_id, None)
+        if record is not None:
+            channels.pop(record.channel_id, None)
+            record.closed_at = to_timestamp(event["closed_at"])
+            record.closed_by = int_or_none(event["closed_by"])
+            if closed is not None:
+                closed.add(record)
+    elif op == "delete":
+        channel_id = int_or_none(event.get("channel_id"))
+        record = active.get(user_id)
+        if record is not None and channel_id in (None, record.channel_id):
+            del active[user_id]
+            channels.pop(record.channel_id, None)
+        if closed is not None:
+            if channel_id is None:
+                # Events logged before threads had their own IDs delete them all
+                closed.remove_user(user_id)
+            else:
+                closed.remove(channel_id)
+    else:
+        logger.warning(f"Unknown thread event: {op}")
+
+
+class ThreadStore:
+    """Base class for thread storage backends.
+
+    Every change to a thread goes through :meth:`record`, which applies the
+    event to the in-memory ``active`` (and, if kept, ``closed``) records and
+    the ``channels`` reverse index, then buffers it. The persistence writer
+    periodically hands the buffer to :meth:`write` in an executor thread.
+    Thread history and message bodies are read with the async ``fetch_*``
+    methods.
+    """
+
+    keeps_history = True
+
+    def __init__(self):
+        self.active = {}
+        self.closed = ClosedThreads()
+        self.channels = {}
+        self.seq = 0
+        self.pending = 0
+        self._buffer = []
+
+    @property
+    def needs_compaction(self):
+        return False
+
+    def load(self):
+        raise NotImplementedError
+
+    async def load_history(self):
+        """Finish loading closed thread history after :meth:`load`, if deferred."""
+
+    def record(self, op, **data):
+        self.seq += 1
+        event = {"seq": self.seq, "op": op, **data}
+
+        # Note which thread channels an event touches before the records change
+        user_id = int_or_none(data.get("user_id"))
+        if op == "message":
+            record = self.active.get(user_id)
+            event["channel_id"] = record.channel_id if record else None
+            event["at"] = to_timestamp(data["message"]["created_at"])
+        elif op == "delete":
+            if "channel_id" in data:
+                event["channel_ids"] = [data["channel_id"]]
+            else:
+                records = [self.active.get(user_id), *self.closed.history(user_id)]
+                event["channel_ids"] = [record.channel_id for record in records if record is not None]
+
+        apply_event(self.active, self.closed if self.keeps_history else None, self.channels, event)
+        self._buffer.append(event)
+        self.pending += 1
+        return event
+
+    def _rebuild_channels(self):
+        self.channels.clear()
+        for user_id, record in self.active.items():
+            self.channels[record.channel_id] = user_id
+
+    def drain(self):
+        # Called on the event loop; hands buffered events over to the writer
+        events = self._buffer
+        self._buffer = []
+        return events
+
+    def restore(self, events):
+        # Events whose write failed go back in front of anything buffered since
+        self._buffer[:0] = events
+
+    def write(self, events):
+        raise NotImplementedError
+
+    def snapshot(self):
+        return None
+
+    def restore_snapshot(self, data):
+        pass
+
+    def write_snapshot(self, data):
+        pass
+
+    async def fetch_thread(self, user_id):
+        """Return the active thread record for a user, or their most recent closed one."""
+        raise NotImplementedError
+
+    async def fetch_thread_by_channel(self, channel_id):
+        """Return the thread record, active or closed, of a thread channel."""
+        raise NotImplementedError
+
+    async def fetch_closed_threads(self, limit=25, before=None, after=None, user_id=None):
+        """Return up to ``limit`` closed thread records, most recently closed first.
+
+        ``before``/``after`` are :func:`closed_key` cursors of the neighbouring
+        page; ``user_id`` restricts the listing to one user's history.
+        """
+        raise NotImplementedError
+
+    async def fetch_messages(self, record):
+        """Load the messages of a thread, oldest first."""
+        raise NotImplementedError
+
+    async def fetch_closed_count(self):
+        raise NotImplementedError
+
+    async def fetch_thread_channels(self):
+        """Return ``(user_id, channel_id)`` for every stored thread, active or closed."""
+        raise NotImplementedError
+
+    def read_messages(self, channel_id):
+        """Read the stored messages of a thread channel. Blocking; run it in an executor."""
+        raise NotImplementedError
+
+    def messages(self, channel_id):
+        """Return the stored messages of a thread channel as a lazily read iterable.
+
+        Nothing is read until it is iterated, one message at a time, so it
+        can be streamed into a transcript of any length. It can be iterated
+        more than once and pickled into a worker process.
+        """
+        raise NotImplementedError
+
+    async def refresh_thread(self, user_id):
+        """Reload a user's active thread after another process changed it.
+
+        Only backends that several processes can share implement this.
+        """
+        raise NotImplementedError
+
+    def _replace_active(self, user_id, record):
+        previous = self.active.pop(user_id, None)
+        if previous is not None:
+            self.channels.pop(previous.channel_id, None)
+        if record is not None:
+            self.active[user_id] = record
+            self.channels[record.channel_id] = user_id
+
+    def close(self):
+        pass
+
+
+class MessageFile:
+    """Messages of one thread channel, streamed from its JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+
+class JSONThreadStore(ThreadStore):
+    """Append-only write-ahead log on top of the threads.json snapshot.
+
+    Each thread event (open, message, close, delete) is appended to the log as a
+    single JSON line, so relaying a message costs O(1) I/O. The snapshot is only
+    rewritten on compaction, after which the log is truncated. Message bodies
+    are kept out of both: they are appended to one JSON-lines file per thread
+    channel under ``messages_dir`` and only read back when needed.
+
+    Every event carries a sequence number and the snapshot records the last one
+    it contains, so a crash between writing the snapshot and truncating the log
+    never replays an event twice.
+
+    :meth:`load` only builds the active threads. Closed threads from the
+    snapshot are indexed by :meth:`load_history` in an executor afterwards;
+    until then ``closed`` holds just the threads closed since the snapshot,
+    and deletes are remembered so they can be applied to the rest.
+    """
+
+    def __init__(self, snapshot_path="threads.json", log_path="threads.log", messages_dir="threads", compact_every=1000):
+        super().__init__()
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.messages_dir = messages_dir
+        self.compact_every = compact_every
+        self._file = None
+        # Closed thread dicts from the snapshot, until they are indexed
+        self._closed_data = None
+        self._deleted_channels = set()
+        self._deleted_users = set()
+        self._history_task = None
+        # Last seq whose body reached each thread file in a batch that has
+        # not been fully written yet, so a retried batch never appends twice
+        self._bodies_written = {}
+
+    @property
+    def needs_compaction(self):
+        return self.pending >= self.compact_every
+
+    def _messages_path(self, channel_id):
+        return os.path.join(self.messages_dir, f"{channel_id}.jsonl")
+
+    def load(self):
+        active, closed = {}, ClosedThreads()
+        closed_data = []
+        snapshot_seq = 0
+        # Message lists embedded by versions that kept them in memory
+        legacy_messages = {}
+
+        try:
+            with open(self.snapshot_path, "r") as f:
+                data = json.load(f)
+            snapshot_seq = data.get("seq", 0)
+
+            # Closed threads used to be keyed by user ID; they are rekeyed by
+            # channel ID here and written back that way on the next snapshot
+            for thread in data.get("active", {}).values():
+                record = ThreadRecord.from_dict(thread)
+                active[record.user_id] = record
+                if "messages" in thread:
+                    legacy_messages[record.channel_id] = list(thread["messages"])
+            closed_data = list(data.get("closed", {}).values())
+            for thread in closed_data:
+                if "messages" in thread:
+                    record = ThreadRecord.from_dict(thread)
+                    legacy_messages[record.channel_id] = list(thread["messages"])
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logger.error("Invalid threads snapshot. Replaying log onto empty threads.")
+
+        self.seq = snapshot_seq
+        self.pending = 0
+        self.active = active
+        self.closed = closed
+        self._closed_data = closed_data
+        self._deleted_channels = set()
+        self._deleted_users = set()
+        self._history_task = None
+        self._rebuild_channels()
+
+        # Replay everything logged after the snapshot was taken
+        try:
+            with open(self.log_path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn write from a crash, nothing after it was acknowledged
+                        logger.warning("Skipping corrupt entry in thread log.")
+                        continue
+
+                    # Also skips entries logged again after a failed write
+                    if event.get("seq", 0) <= self.seq:
+                        continue
+
+                    if event["op"] == "message" and "message" in event:
+                        record = active.get(int(event["user_id"]))
+                        if record is not None:
+                            legacy_messages.setdefault(record.channel_id, []).append(event["message"])
+                    elif event["op"] == "delete":
+                        self._note_delete(event)
+
+                    apply_event(active, closed, self.channels, event)
+                    self.seq = event["seq"]
+                    self.pending += 1
+        except FileNotFoundError:
+            pass
+
+        if self.pending:
+            logger.info(f"Replayed {self.pending} thread events from {self.log_path}")
+
+        if legacy_messages:
+            # The migration rewrites the snapshot, which needs the full history
+            self._merge_history(self._build_history(self._closed_data))
+            self._migrate_messages(legacy_messages)
+
+    def _note_delete(self, event):
+        # Deletes that reach threads whose history is not indexed yet
+        if self._closed_data is None:
+            return
+        if event.get("channel_id") is not None:
+            self._deleted_channels.add(int(event["channel_id"]))
+        else:
+            self._deleted_users.add(int(event["user_id"]))
+
+    @staticmethod
+    def _build_history(closed_data):
+        # Sorting first turns every insert into an append
+        records = sorted((ThreadRecord.from_dict(thread) for thread in closed_data), key=closed_key)
+        history = ClosedThreads()
+        for record in records:
+            history.add(record)
+        return history
+
+    def _merge_history(self, history):
+        # Called on the event loop with the indexed snapshot history
+        if self._closed_data is None:
+            return
+        for channel_id in self._deleted_channels:
+            history.remove(channel_id)
+        for user_id in self._deleted_users:
+            history.remove_user(user_id)
+        for record in self.closed.values():
+            history.add(record)
+
+        self.closed = history
+        self._closed_data = None
+        self._deleted_channels.clear()
+        self._deleted_users.clear()
+
+    def _ensure_history(self):
+        # Synchronous fallback for callers that need every closed thread right away
+        if self._closed_data is not None:
+            self._merge_history(self._build_history(self._closed_data))
+
+    async def load_history(self):
+        if self._closed_data is None:
+            return
+        if self._history_task is None:
+            self._history_task = asyncio.get_running_loop().run_in_executor(
+                None, self._build_history, self._closed_data
+            )
+        history = await asyncio.shield(self._history_task)
+        self._merge_history(history)
+
+    def record(self, op, **data):
+        event = super().record(op, **data)
+        if op == "delete":
+            self._note_delete(event)
+        return event
+
+    def _migrate_messages(self, legacy_messages):
+        # Move inline message lists out to per-thread files, then compact so
+        # neither the snapshot nor the log carries them any more
+        os.makedirs(self.messages_dir, exist_ok=True)
+        for channel_id, messages in legacy_messages.items():
+            with open(self._messages_path(channel_id), "w") as f:
+                f.write("".join(json.dumps(msg) + "\n" for msg in messages))
+
+        self.write_snapshot(self.snapshot())
+        logger.info(f"Moved the messages of {len(legacy_messages)} threads to {self.messages_dir}/")
+
+    def _write_messages(self, events):
+        # Append message bodies to their thread files and drop deleted threads
+        bodies = {}
+        for event in events:
+            if event["op"] == "message" and event.get("channel_id") is not None:
+                if event["seq"] <= self._bodies_written.get(event["channel_id"], 0):
+                    continue
+                lines, _ = bodies.get(event["channel_id"], ([], 0))
+                lines.append(json.dumps(event["message"]) + "\n")
+                bodies[event["channel_id"]] = (lines, event["seq"])
+
+        if bodies:
+            os.makedirs(self.messages_dir, exist_ok=True)
+            for channel_id, (lines, last_seq) in bodies.items():
+                with open(self._messages_path(channel_id), "a") as f:
+                    f.write("".join(lines))
+                self._bodies_written[channel_id] = last_seq
+
+        for event in events:
+            if event["op"] != "delete":
+                continue
+            for channel_id in event.get("channel_ids", []):
+                try:
+                    os.remove(self._messages_path(channel_id))
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _log_entry(event):
+        if event["op"] == "message":
+            # The body lives in the thread's message file
+            return {"seq": event["seq"], "op": "message", "user_id": event["user_id"], "at": event["at"]}
+        return event
+
+    def write(self, events):
+        # Called from the persistence writer's executor thread
+        if not events:
+            return
+
+        # Bodies first, so the log never counts a message that is not on disk
+        self._write_messages(events)
+
+        if self._file is None:
+            self._file = open(self.log_path, "a")
+        data = "".join(json.dumps(self._log_entry(event)) + "\n" for event in events)
+        self._file.write(data)
+        self._file.flush()
+        self._bodies_written.clear()
+        return len(data)
+
+    def snapshot(self):
+        # Called on the event loop. Buffered events are part of the snapshot, so
+        # they are not written to a log that is about to be truncated; only
+        # their message bodies still have to reach disk. Callers await
+        # load_history() first, so this only builds the history as a fallback.
+        self._ensure_history()
+        events = self._buffer
+        self._buffer = []
+        self.pending = 0
+        return {
+            "seq": self.seq,
+            "active": {str(user_id): record.to_dict() for user_id, record in self.active.items()},
+            "closed": {str(record.channel_id): record.to_dict() for record in self.closed.values()},
+            "events": events
+        }
+
+    def restore_snapshot(self, data):
+        # The snapshot was not written; its events still have to reach disk
+        self.restore(data["events"])
+
+    def write_snapshot(self, data):
+        # Called from the persistence writer's executor thread
+        self._write_messages(data["events"])
+        size = atomic_write_json(
+            self.snapshot_path,
+            {name: value for name, value in data.items() if name != "events"},
+            indent=4
+        )
+
+        # Everything in the log is now covered by the snapshot
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        open(self.log_path, "w").close()
+        self._bodies_written.clear()
+        return size
+
+    def read_messages(self, channel_id):
+        return list(self.messages(channel_id))
+
+    def messages(self, channel_id):
+        return MessageFile(self._messages_path(channel_id))
+
+    async def fetch_thread(self, user_id):
+        if user_id in self.active:
+            return self.active[user_id]
+        await self.load_history()
+        return self.closed.latest(user_id)
+
+    async def fetch_thread_by_channel(self, channel_id):
+        if channel_id in self.channels:
+            return self.active[self.channels[channel_id]]
+        await self.load_history()
+        return self.closed.get(channel_id)
+
+    async def fetch_closed_threads(self, limit=25, before=None, after=None, user_id=None):
+        await self.load_history()
+        return self.closed.page(limit, before, after, user_id)
+
+    async def fetch_closed_count(self):
+        await self.load_history()
+        return len(self.closed)
+
+    async def fetch_thread_channels(self):
+        await self.load_history()
+        records = [*self.active.values(), *self.closed.values()]
+        return [(record.user_id, record.channel_id) for record in records]
+
+    async def fetch_messages(self, record):
+        return await asyncio.get_running_loop().run_in_executor(None, self.read_messages, record.channel_id)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    closed_at TEXT,
+    closed_by INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_threads_user_closed_at ON threads (user_id, closed_at);
+CREATE INDEX IF NOT EXISTS idx_threads_channel_id ON threads (channel_id);
+CREATE INDEX IF NOT EXISTS idx_threads_closed_at_channel_id ON threads (closed_at, channel_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    thread_id INTEGER NOT NULL REFERENCES threads (id),
+    message_id INTEGER,
+    content TEXT,
+    author_id INTEGER,
+    created_at TEXT NOT NULL,
+    is_staff INTEGER NOT NULL DEFAULT 0,
+    attachments TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_thread_id ON messages (thread_id);
+"""
+
+# Thread rows along with their message count and latest message time
+THREAD_QUERY = """
+SELECT threads.*,
+    (SELECT COUNT(*) FROM messages WHERE thread_id = threads.id) AS message_count,
+    (SELECT MAX(created_at) FROM messages WHERE thread_id = threads.id) AS last_message_at
+FROM threads
+"""
+
+
+MESSAGES_QUERY = """
+SELECT messages.* FROM messages JOIN threads ON threads.id = messages.thread_id
+WHERE threads.channel_id = ? ORDER BY messages.id
+"""
+
+
+def _message_from_row(row):
+    msg = {
+        "message_id": str_or_none(row["message_id"]),
+        "content": row["content"],
+        "author_id": str_or_none(row["author_id"]),
+        "created_at": row["created_at"],
+        "is_staff": bool(row["is_staff"])
+    }
+    if row["attachments"]:
+        msg["attachments"] = json.loads(row["attachments"])
+    return msg
+
+
+class MessageQuery:
+    """Messages of one thread channel, streamed from a SQLite cursor.
+
+    Each iteration opens its own connection, so it works in any thread or
+    worker process.
+    """
+
+    def __init__(self, path, channel_id):
+        self.path = path
+        self.channel_id = channel_id
+
+    def __iter__(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(MESSAGES_QUERY, (self.channel_id,)):
+                yield _message_from_row(row)
+        finally:
+            conn.close()
+
+
+class SQLiteThreadStore(ThreadStore):
+    """SQLite-backed thread store.
+
+    Only active thread records are held in memory; closed threads and all
+    messages are looked up through indexed queries on demand. Each worker
+    thread gets its own connection and the database runs in WAL mode, so the
+    background writer never blocks readers.
+    """
+
+    keeps_history = False
+
+    def __init__(self, path="threads.db"):
+        super().__init__()
+        self.path = path
+        self._connections = ThreadConnections(path, row_factory=sqlite3.Row)
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sqlite-store")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _ensure_schema(self, conn):
+        conn.executescript(SCHEMA)
+
+        # Superseded by the composite indexes above
+        conn.execute("DROP INDEX IF EXISTS idx_threads_user_id")
+        conn.execute("DROP INDEX IF EXISTS idx_threads_closed_at")
+
+        # Databases created before attachments were recorded
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "attachments" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN attachments TEXT")
+
+    def load(self):
+        conn = self._connections.get()
+        self._ensure_schema(conn)
+
+        rows = conn.execute(THREAD_QUERY + "WHERE closed_at IS NULL").fetchall()
+        self.active = {row["user_id"]: self._record_from_row(row) for row in rows}
+        self.closed = ClosedThreads()
+        self._rebuild_channels()
+
+    def write(self, events):
+        # Called from the persistence writer's executor thread
+        if not events:
+            return
+
+        conn = self._connections.get()
+        with conn:
+            for event in events:
+                self._apply(conn, event)
+
+    def _apply(self, conn, event):
+        op = event["op"]
+
+        if op == "open":
+            self._insert_thread(conn, ThreadRecord.from_dict(event["thread"]))
+        elif op == "message":
+            row = conn.execute(
+                "SELECT id FROM threads WHERE channel_id = ? ORDER BY id DESC LIMIT 1",
+                (event["channel_id"],)
+            ).fetchone()
+            if row is not None:
+                self._insert_messages(conn, row["id"], [event["message"]])
+        elif op == "close":
+            conn.execute(
+                "UPDATE threads SET closed_at = ?, closed_by = ? WHERE user_id = ? AND closed_at IS NULL",
+                (
+                    to_isoformat(to_timestamp(event["closed_at"])),
+                    int_or_none(event["closed_by"]),
+                    int(event["user_id"])
+                )
+            )
+        elif op == "delete":
+            if event.get("channel_id") is not None:
+                where, key = "channel_id = ?", int(event["channel_id"])
+            else:
+                where, key = "user_id = ?", int(event["user_id"])
+            conn.execute(
+                f"DELETE FROM messages WHERE thread_id IN (SELECT id FROM threads WHERE {where})",
+                (key,)
+            )
+            conn.execute(f"DELETE FROM threads WHERE {where}", (key,))
+
+    def _insert_thread(self, conn, record, messages=()):
+        cursor = conn.execute(
+            "INSERT INTO threads (user_id, channel_id, created_at, closed_at, closed_by) VALUES (?, ?, ?, ?, ?)",
+            (
+                record.user_id,
+                record.channel_id,
+                to_isoformat(record.created_at),
+                to_isoformat(record.closed_at),
+                record.closed_by
+            )
+        )
+        self._insert_messages(conn, cursor.lastrowid, messages)
+
+    def _insert_messages(self, conn, thread_id, messages):
+        conn.executemany(
+            "INSERT INTO messages (thread_id, message_id, content, author_id, created_at, is_staff, attachments) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    thread_id,
+                    int_or_none(msg.get("message_id")),
+                    msg.get("content"),
+                    int_or_none(msg.get("author_id")),
+                    msg["created_at"],
+                    int(bool(msg.get("is_staff", False))),
+                    json.dumps(msg["attachments"]) if msg.get("attachments") else None
+                )
+                for msg in messages
+            ]
+        )
+
+    def _record_from_row(self, row):
+        return ThreadRecord(
+            user_id=row["user_id"],
+            channel_id=row["channel_id"],
+            created_at=to_timestamp(row["created_at"]),
+            last_activity=to_timestamp(row["last_message_at"]),
+            message_count=row["message_count"],
+            closed_at=to_timestamp(row["closed_at"]),
+            closed_by=row["closed_by"]
+        )
+
+    def read_messages(self, channel_id):
+        rows = self._connections.get().execute(MESSAGES_QUERY, (channel_id,)).fetchall()
+        return [_message_from_row(row) for row in rows]
+
+    def messages(self, channel_id):
+        return MessageQuery(self.path, channel_id)
+
+    def _fetch_closed(self, limit, before, after, user_id):
+        clauses = ["closed_at IS NOT NULL"]
+        params = []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+
+        # Cursors compare on the same (closed_at, channel_id) order as the index
+        order = "DESC"
+        if after is not None:
+            clauses.append("(closed_at, channel_id) > (?, ?)")
+            params += [to_isoformat(after[0]), after[1]]
+            order = "ASC"
+        elif before is not None:
+            clauses.append("(closed_at, channel_id) < (?, ?)")
+            params += [to_isoformat(before[0]), before[1]]
+
+        rows = self._connections.get().execute(
+            THREAD_QUERY + f"WHERE {' AND '.join(clauses)} ORDER BY closed_at {order}, channel_id {order} LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        records = [self._record_from_row(row) for row in rows]
+        return records[::-1] if after is not None else records
+
+    async def fetch_thread(self, user_id):
+        if user_id in self.active:
+            return self.active[user_id]
+        history = await self._run(self._fetch_closed, 1, None, None, user_id)
+        return history[0] if history else None
+
+    def _read_by_channel(self, channel_id):
+        row = self._connections.get().execute(
+            THREAD_QUERY + "WHERE channel_id = ? ORDER BY id DESC LIMIT 1",
+            (channel_id,)
+        ).fetchone()
+        return self._record_from_row(row) if row is not None else None
+
+    async def fetch_thread_by_channel(self, channel_id):
+        if channel_id in self.channels:
+            return self.active[self.channels[channel_id]]
+        return await self._run(self._read_by_channel, channel_id)
+
+    async def fetch_closed_threads(self, limit=25, before=None, after=None, user_id=None):
+        return await self._run(self._fetch_closed, limit, before, after, user_id)
+
+    def _count_closed(self):
+        return self._connections.get().execute("SELECT COUNT(*) FROM threads WHERE closed_at IS NOT NULL").fetchone()[0]
+
+    async def fetch_closed_count(self):
+        return await self._run(self._count_closed)
+
+    def _thread_channels(self):
+        return [tuple(row) for row in self._connections.get().execute("SELECT user_id, channel_id FROM threads ORDER BY id")]
+
+    async def fetch_thread_channels(self):
+        return await self._run(self._thread_channels)
+
+    async def fetch_messages(self, record):
+        return await self._run(self.read_messages, record.channel_id)
+
+    def _read_active(self, user_id):
+        row = self._connections.get().execute(
+            THREAD_QUERY + "WHERE user_id = ? AND closed_at IS NULL ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        return self._record_from_row(row) if row is not None else None
+
+    async def refresh_thread(self, user_id):
+        record = await self._run(self._read_active, user_id)
+        self._replace_active(user_id, record)
+        return record
+
+    def is_empty(self):
+        conn = self._connections.get()
+        self._ensure_schema(conn)
+        return conn.execute("SELECT 1 FROM threads LIMIT 1").fetchone() is None
+
+    def import_threads(self, threads):
+        """Bulk-load ``(record, messages)`` pairs, e.g. from the JSON store."""
+        conn = self._connections.get()
+        self._ensure_schema(conn)
+        with conn:
+            for record, messages in threads:
+                self._insert_thread(conn, record, messages)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._connections.close()
+
+
+def migrate_json_to_sqlite(snapshot_path="threads.json", log_path="threads.log", messages_dir="threads", db_path="threads.db"):
+    """One-shot migration of threads.json (with its log and message files) into a SQLite store."""
+    json_store = JSONThreadStore(snapshot_path, log_path, messages_dir)
+    json_store.load()
+    json_store._ensure_history()
+
+    sqlite_store = SQLiteThreadStore(db_path)
+    try:
+        if not sqlite_store.is_empty():
+            logger.warning(f"{db_path} already contains threads. Skipping migration.")
+            return False
+
+        records = list(json_store.closed.values()) + list(json_store.active.values())
+        sqlite_store.import_threads(
+            (record, json_store.read_messages(record.channel_id)) for record in records
+        )
+        logger.info(
+            f"Migrated {len(json_store.active)} active and {len(json_store.closed)} "
+            f"closed threads from {snapshot_path} to {db_path}"
+        )
+        return True
+    finally:
+        json_store.close()
+        sqlite_store.close()
+
+
+def create_store(backend="json"):
+    if backend == "sqlite":
+        # First start on SQLite picks up the existing JSON history
+        legacy = os.path.exists("threads.json") or os.path.exists("threads.log")
+        if legacy and not os.path.exists("threads.db"):
+            migrate_json_to_sqlite()
+        return SQLiteThreadStore("threads.db")
+
+    if backend != "json":
+        logger.warning(f"Unknown storage backend '{backend}'. Falling back to JSON.")
+    return JSONThreadStore("threads.json", "threads.log", "threads")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate_json_to_sqlite()
@@ -0,0 +1,494 @@
+import asyncio
+import datetime
+import gzip
+import html
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import discord
+
+from core.attachments import close_file, upload_limit
+from core.models import to_isoformat
+
+logger = logging.getLogger("ModmailBot")
+
+# Discord allows at most this many files on one message
+MAX_FILES_PER_MESSAGE = 10
+
+# Room left under the upload limit for the rest of the request
+UPLOAD_HEADROOM = 512 * 1024
+
+TRANSCRIPT_FORMATS = ("md", "html", "jsonl")
+
+# Bump whenever rendered output changes so cached transcripts are rebuilt
+RENDER_VERSION = 1
+
+HTML_STYLE = """
+body { margin: 0; padding: 24px; background: #313338; color: #dbdee1; font: 15px/1.4 "Helvetica Neue", Arial, sans-serif; }
+header { border-bottom: 1px solid #4e5058; margin-bottom: 16px; padding-bottom: 8px; }
+h1 { font-size: 20px; margin: 0 0 8px; }
+.message { padding: 8px 0; border-bottom: 1px solid #3f4147; }
+.author { font-weight: bold; color: #f2f3f5; }
+.staff .author { color: #3498db; }
+.tag { font-size: 11px; background: #5865f2; color: #fff; border-radius: 3px; padding: 1px 4px; margin-left: 4px; }
+time { color: #949ba4; font-size: 12px; margin-left: 8px; }
+.content { white-space: pre-wrap; word-wrap: break-word; margin-top: 4px; }
+a { color: #00a8fc; }
+"""
+
+# Closing tags of an HTML transcript, after the last message
+HTML_TAIL = "</main>\n</body>\n</html>\n"
+
+
+def _author_name(msg, names):
+    author_id = msg.get("author_id", "unknown")
+    return names.get(author_id) or f"Unknown User ({author_id})"
+
+
+def _created_at(msg):
+    return datetime.datetime.fromisoformat(msg.get("created_at", datetime.datetime.utcnow().isoformat()))
+
+
+def render_markdown(thread_id, record, messages, names):
+    """Yield the markdown transcript of a thread one message at a time.
+
+    ``messages`` is iterated once, so it can stream from the thread store
+    (see ``ThreadStore.messages``). ``names`` maps author IDs to display
+    names; unknown authors fall back to their ID.
+    """
+    user_name = names.get(thread_id) or f"Unknown_{thread_id}"
+
+    header = "# ModMail Thread Transcript\n\n"
+    header += f"User: {user_name} ({thread_id})\n"
+    header += f"Created: {to_isoformat(record.created_at)}\n"
+    if record.is_closed:
+        header += f"Closed: {to_isoformat(record.closed_at)}\n"
+    header += f"Total Messages: {record.message_count}\n\n"
+    header += "---\n\n"
+    yield header
+
+    for msg in messages:
+        staff_tag = "(Staff)" if msg.get("is_staff", False) else ""
+        author_name = f"{_author_name(msg, names)} {staff_tag}"
+        created_at = _created_at(msg)
+        content = msg.get("content", "[No content]")
+
+        parts = [
+            f"## {author_name} - {created_at.strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n",
+            f"{content}\n\n"
+        ]
+        attachments = msg.get("attachments", [])
+        for record in attachments:
+            parts.append(f"Attachment: [{record['filename']}]({record['url']})\n")
+        if attachments:
+            parts.append("\n")
+        parts.append("---\n\n")
+
+        yield "".join(parts)
+
+
+def render_html(thread_id, record, messages, names):
+    """Yield a self-contained HTML transcript of a thread; styles are inlined."""
+    user_name = html.escape(names.get(thread_id) or f"Unknown_{thread_id}")
+
+    details = [f"User: {user_name} ({thread_id})", f"Created: {to_isoformat(record.created_at)}"]
+    if record.is_closed:
+        details.append(f"Closed: {to_isoformat(record.closed_at)}")
+    details.append(f"Total Messages: {record.message_count}")
+
+    yield (
+        "<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n"
+        f"<title>ModMail Thread Transcript - {user_name}</title>\n"
+        f"<style>{HTML_STYLE}</style>\n</head>\n<body>\n<header>\n<h1>ModMail Thread Transcript</h1>\n"
+        + "".join(f"<div>{line}</div>\n" for line in details)
+        + "</header>\n<main>\n"
+    )
+
+    for msg in messages:
+        is_staff = msg.get("is_staff", False)
+        parts = [
+            f"<div class=\"message{' staff' if is_staff else ''}\">\n",
+            f"<span class=\"author\">{html.escape(_author_name(msg, names))}</span>",
+            "<span class=\"tag\">Staff</span>" if is_staff else "",
+            f"<time>{_created_at(msg).strftime('%Y-%m-%d %H:%M:%S UTC')}</time>\n",
+            f"<div class=\"content\">{html.escape(msg.get('content') or '[No content]')}</div>\n"
+        ]
+        attachments = msg.get("attachments", [])
+        if attachments:
+            parts.append("<ul class=\"attachments\">\n")
+            for attachment in attachments:
+                parts.append(
+                    f"<li><a href=\"{html.escape(attachment['url'])}\">{html.escape(attachment['filename'])}</a></li>\n"
+                )
+            parts.append("</ul>\n")
+        parts.append("</div>\n")
+
+        yield "".join(parts)
+
+    yield HTML_TAIL
+
+
+def render_jsonl(thread_id, record, messages, names):
+    """Yield a JSON-lines transcript: one line describing the thread, then one per message."""
+    yield json.dumps({
+        "type": "thread",
+        "user_id": str(thread_id),
+        "user_name": names.get(thread_id),
+        "channel_id": str(record.channel_id),
+        "created_at": to_isoformat(record.created_at),
+        "closed_at": to_isoformat(record.closed_at),
+        "closed_by": str(record.closed_by) if record.closed_by else None,
+        "message_count": record.message_count
+    }) + "\n"
+
+    for msg in messages:
+        yield json.dumps({"type": "message", **msg, "author_name": names.get(msg.get("author_id"))}) + "\n"
+
+
+RENDERERS = {
+    "md": render_markdown,
+    "html": render_html,
+    "jsonl": render_jsonl
+}
+
+
+def scan_messages(messages):
+    """Return the author IDs and attachment records of a thread in one pass.
+
+    Blocking; run it in an executor.
+    """
+    author_ids = set()
+    attachments = []
+    for msg in messages:
+        if msg.get("author_id", "").isdigit():
+            author_ids.add(msg["author_id"])
+        attachments += msg.get("attachments", [])
+    return author_ids, attachments
+
+
+def render_to_file(fmt, path, thread_id, record, messages, names):
+    """Render a transcript format into ``path`` atomically. Returns the size written.
+
+    Module-level so it can run in a worker process.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        for chunk in RENDERERS[fmt](thread_id, record, messages, names):
+            f.write(chunk)
+        size = f.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+class TranscriptCache:
+    """Transcripts of closed threads, rendered once and kept on disk.
+
+    A closed thread no longer changes, so every configured format is
+    rendered when it closes and exports only upload the files. Each thread
+    has a directory under ``directory`` with one file per format, the
+    thread's attachment records and a ``key`` file written last; a key that does not match the thread (other
+    formats, message count, close time or render version) means the
+    transcripts are rendered again. HTML, the most expensive format, is
+    rendered in a process pool; the rest in the default executor.
+
+    ``load(record)`` is an async callable returning ``(messages, names,
+    attachments)`` for a thread, with ``messages`` and ``names`` as
+    :func:`render_markdown` expects them. ``messages`` is streamed into
+    every format, so it must pickle into the HTML worker process.
+    """
+
+    def __init__(self, load, directory="transcripts", formats=TRANSCRIPT_FORMATS, workers=1):
+        self.load = load
+        self.directory = directory
+        self.formats = tuple(fmt for fmt in formats if fmt in RENDERERS) or ("md",)
+        self.workers = workers
+        self._pool = None
+        self._rendering = {}
+
+    def key(self, record):
+        return f"{RENDER_VERSION}:{','.join(self.formats)}:{record.message_count}:{to_isoformat(record.closed_at)}"
+
+    def _thread_dir(self, channel_id):
+        return os.path.join(self.directory, str(channel_id))
+
+    def paths(self, channel_id):
+        return {fmt: os.path.join(self._thread_dir(channel_id), f"transcript.{fmt}") for fmt in self.formats}
+
+    def lookup(self, record):
+        """Return the cached ``({format: path}, attachments)`` of a thread, or None if missing or stale."""
+        directory = self._thread_dir(record.channel_id)
+        try:
+            with open(os.path.join(directory, "key"), "r") as f:
+                if f.read() != self.key(record):
+                    return None
+            with open(os.path.join(directory, "attachments.json"), "r") as f:
+                attachments = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return self.paths(record.channel_id), attachments
+
+    def _process_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def _render(self, record):
+        loop = asyncio.get_running_loop()
+        messages, names, attachments = await self.load(record)
+
+        directory = self._thread_dir(record.channel_id)
+        key_path = os.path.join(directory, "key")
+        await loop.run_in_executor(None, os.makedirs, directory, 0o777, True)
+        # A half-rendered directory must never look valid
+        await loop.run_in_executor(None, _remove, key_path)
+
+        paths = self.paths(record.channel_id)
+        await asyncio.gather(*(
+            loop.run_in_executor(
+                self._process_pool() if fmt == "html" else None,
+                render_to_file, fmt, path, record.user_id, record, messages, names
+            )
+            for fmt, path in paths.items()
+        ))
+
+        await loop.run_in_executor(
+            None, _write_text, os.path.join(directory, "attachments.json"), json.dumps(attachments)
+        )
+        await loop.run_in_executor(None, _write_text, key_path, self.key(record))
+        return paths, attachments
+
+    async def get(self, record):
+        """Return ``({format: path}, attachments)`` for a closed thread, rendering it first if needed."""
+        task = self._rendering.get(record.channel_id)
+        if task is None:
+            cached = await asyncio.get_running_loop().run_in_executor(None, self.lookup, record)
+            if cached is not None:
+                return cached
+            # Re-check: a render may have started while the lookup ran
+            task = self._rendering.get(record.channel_id)
+            if task is None:
+                task = asyncio.ensure_future(self._render(record))
+                self._rendering[record.channel_id] = task
+                task.add_done_callback(lambda _: self._rendering.pop(record.channel_id, None))
+        return await asyncio.shield(task)
+
+    def prerender(self, record):
+        """Render a just-closed thread in the background."""
+        task = asyncio.create_task(self.get(record))
+        task.add_done_callback(_log_failure)
+        return task
+
+    async def discard(self, channel_id):
+        await asyncio.get_running_loop().run_in_executor(
+            None, shutil.rmtree, self._thread_dir(channel_id), True
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_text(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Failed to render transcripts: {task.exception()}")
+
+
+class TranscriptPart:
+    def __init__(self, filename, fp, size):
+        self.filename = filename
+        self.fp = fp
+        self.size = size
+
+
+class _PartWriter:
+    def __init__(self, spool_size, compress, flush_every=256 * 1024):
+        self.fp = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.compress = compress
+        self.flush_every = flush_every
+        self._gzip = gzip.GzipFile(fileobj=self.fp, mode="wb") if compress else None
+        self._unflushed = 0
+        self.written = 0
+
+    def upper_bound(self, extra):
+        # Compressed output never exceeds the input by more than a few bytes,
+        # so bytes still buffered inside the compressor are counted as-is
+        return self.fp.tell() + self._unflushed + extra + 64
+
+    def write(self, data):
+        self.written += len(data)
+        if self._gzip is None:
+            self.fp.write(data)
+            return
+
+        self._gzip.write(data)
+        self._unflushed += len(data)
+        if self._unflushed >= self.flush_every:
+            self._gzip.flush()
+            self._unflushed = 0
+
+    def finish(self):
+        if self._gzip is not None:
+            self._gzip.close()
+        size = self.fp.tell()
+        self.fp.seek(0)
+        return size
+
+
+def write_transcript(chunks, filename, max_bytes, compress=False, spool_size=1024 * 1024, head="", tail=""):
+    """Stream text chunks into one or more spooled files of at most ``max_bytes``.
+
+    Parts are only cut between chunks, and ``head`` and ``tail`` are written
+    at the start and end of every part. Each part stays in memory up to
+    ``spool_size`` bytes and spills to disk beyond that, so memory use does
+    not depend on the transcript length. Returns a list of
+    :class:`TranscriptPart`.
+    """
+    head = head.encode("utf-8")
+    tail = tail.encode("utf-8")
+    parts = []
+    writer = _PartWriter(spool_size, compress)
+    writer.write(head)
+
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        if writer.written > len(head) and writer.upper_bound(len(data) + len(tail)) > max_bytes:
+            writer.write(tail)
+            parts.append(writer)
+            writer = _PartWriter(spool_size, compress)
+            writer.write(head)
+        writer.write(data)
+    writer.write(tail)
+    parts.append(writer)
+
+    stem, dot, ext = filename.rpartition(".")
+    if not dot:
+        stem, ext = filename, "md"
+    suffix = f".{ext}.gz" if compress else f".{ext}"
+
+    result = []
+    for index, writer in enumerate(parts, start=1):
+        name = f"{stem}{suffix}" if len(parts) == 1 else f"{stem}_part{index}{suffix}"
+        size = writer.finish()
+        result.append(TranscriptPart(name, writer.fp, size))
+    return result
+
+
+def _html_messages(f):
+    # Message content is escaped, so a line opening a message div can only
+    # be the start of the next message
+    message = []
+    for line in f:
+        if line == "</main>\n":
+            break
+        if line.startswith("<div class=\"message") and message:
+            yield "".join(message)
+            message = []
+        message.append(line)
+    if message:
+        yield "".join(message)
+
+
+def split_file(path, filename, max_bytes, compress=False):
+    """Re-chunk a rendered transcript file with :func:`write_transcript`.
+
+    HTML is only cut between messages and every part repeats the document
+    head and closing tags, so each part is still a page of its own.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if not filename.endswith(".html"):
+            return write_transcript(f, filename, max_bytes, compress)
+
+        head = []
+        for line in f:
+            head.append(line)
+            if line == "<main>\n":
+                break
+        return write_transcript(
+            _html_messages(f), filename, max_bytes, compress, head="".join(head), tail=HTML_TAIL
+        )
+
+
+def open_rendered(paths, stem, max_bytes, compress=False):
+    """Open rendered transcript files (``{format: path}``) for upload as ``stem.<format>``.
+
+    Files that fit in ``max_bytes`` are sent as they are; larger ones, or
+    all of them with ``compress``, are re-chunked with :func:`split_file`.
+    Returns a list of :class:`TranscriptPart`.
+    """
+    parts = []
+    for fmt, path in paths.items():
+        size = os.path.getsize(path)
+        if size <= max_bytes and not compress:
+            parts.append(TranscriptPart(f"{stem}.{fmt}", open(path, "rb"), size))
+        else:
+            parts += split_file(path, f"{stem}.{fmt}", max_bytes, compress)
+    return parts
+
+
+def batch_uploads(items, max_bytes, max_files=MAX_FILES_PER_MESSAGE):
+    """Group ``(item, size)`` pairs into batches that fit on one message each."""
+    batches = []
+    current = []
+    current_size = 0
+
+    for item, size in items:
+        if current and (len(current) >= max_files or current_size + size > max_bytes):
+            batches.append(current)
+            current = []
+            current_size = 0
+        current.append(item)
+        current_size += size
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def transcript_limit(destination):
+    """Return the size transcripts sent to ``destination`` are split at."""
+    return upload_limit(destination) - UPLOAD_HEADROOM
+
+
+async def send_transcript(send, parts, attachments, open_cached, limit, **kwargs):
+    """Upload transcript parts, and the attachments still cached, in as few messages as fit.
+
+    ``send`` posts one message (e.g. ``channel.send``); the first one also
+    gets ``kwargs``, such as its content or embed, and is sent even without
+    files. ``parts`` are :class:`TranscriptPart` s, ``attachments`` the
+    thread's attachment records and ``open_cached(record)`` returns a
+    ``discord.File`` for a cached attachment or None. Every file is closed
+    afterwards.
+    """
+    uploads = [(discord.File(part.fp, filename=part.filename), part.size) for part in parts]
+    try:
+        for attachment in attachments:
+            if attachment["size"] > limit:
+                continue
+            file = open_cached(attachment)
+            if file:
+                uploads.append((file, attachment["size"]))
+
+        batches = batch_uploads(uploads, limit) or [[]]
+        await send(files=batches[0], **kwargs)
+        for batch in batches[1:]:
+            await send(files=batch)
+    finally:
+        for file, _ in uploads:
+            close_file(file)
@@ -0,0 +1,81 @@
+import asyncio
+import collections
+import time
+
+import discord
+
+
+class UserResolver:
+    """Resolves user IDs to users with as few REST calls as possible.
+    
+    Lookups check the gateway cache first, then a TTL-bounded local cache, and
+    only then fetch from the API. Concurrent lookups for the same ID share a
+    single request and :meth:`resolve_many` fetches distinct IDs in parallel.
+    Users that no longer exist are cached as ``None``.
+    """
+    
+    def __init__(self, bot, ttl=3600, max_size=10000, concurrency=5):
+        self.bot = bot
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = collections.OrderedDict()
+        self._inflight = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        
+        self.fetches = 0
+    
+    def _cached(self, user_id):
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return False, None
+        
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._cache[user_id]
+            return False, None
+        return True, user
+    
+    def _store(self, user_id, user):
+        self._cache[user_id] = (time.monotonic() + self.ttl, user)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+    
+    async def _fetch(self, user_id):
+        async with self._semaphore:
+            self.fetches += 1
+            try:
+                user = await self.bot.fetch_user(user_id)
+            except discord.NotFound:
+                user = None
+        self._store(user_id, user)
+        return user
+    
+    async def resolve(self, user_id):
+        user_id = int(user_id)
+        
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            return user
+        
+        found, user = self._cached(user_id)
+        if found:
+            return user
+        
+        # Share the request with anyone already fetching this user
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        
+        try:
+            return await asyncio.shield(task)
+        except discord.HTTPException:
+            return None
+    
+    async def resolve_many(self, user_ids):
+        """Resolve a collection of IDs, returning a dict keyed by the IDs as given."""
+        distinct = list(dict.fromkeys(user_ids))
+        users = await asyncio.gather(*(self.resolve(user_id) for user_id in distinct))
+        return dict(zip(distinct, users))
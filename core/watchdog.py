@@ -0,0 +1,111 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("ModmailBot")
+
+
+class HandlerTimings:
+    """Durations of recently finished handlers (relay jobs, commands)."""
+
+    def __init__(self, size=512):
+        self._recent = collections.deque(maxlen=size)
+
+    def record(self, name, duration):
+        self._recent.append((time.monotonic(), duration, name))
+
+    def slowest(self, count=5, window=60.0):
+        """Return the ``count`` slowest ``(duration, name)`` pairs of the last ``window`` seconds."""
+        cutoff = time.monotonic() - window
+        recent = [(duration, name) for finished_at, duration, name in self._recent if finished_at >= cutoff]
+        recent.sort(reverse=True)
+        return recent[:count]
+
+
+class LoopWatchdog:
+    """Detects and explains event loop stalls.
+
+    A heartbeat task on the loop records when it last ran. A separate thread
+    checks the heartbeat and, once the loop has been stuck for longer than
+    ``threshold`` seconds, logs the stack of the loop thread, i.e. the code
+    that is blocking it. When the loop catches up the total lag is logged
+    together with the slowest recent handlers.
+    """
+
+    def __init__(self, timings, threshold=0.5, interval=0.1):
+        self.timings = timings
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._captured = False
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold}s)")
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - self._beat - self.interval
+            if lag > self.threshold:
+                self._report(lag)
+
+    def _monitor(self):
+        # Runs in its own thread so it can look at the loop while it is blocked
+        while not self._stop.wait(self.interval):
+            stalled_for = time.monotonic() - self._beat - self.interval
+            if stalled_for <= self.threshold or self._captured:
+                continue
+
+            self._captured = True
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(f"Event loop blocked for {stalled_for:.3f}s so far, currently running:\n{stack}")
+
+    def _report(self, lag):
+        self.stalls += 1
+        self._captured = False
+
+        slowest = self.timings.slowest()
+        details = "\n".join(f"  {duration * 1000:.1f} ms  {name}" for duration, name in slowest)
+        message = f"Event loop lagged {lag:.3f}s (threshold {self.threshold}s)"
+        if details:
+            message += f". Slowest recent handlers:\n{details}"
+        logger.warning(message)
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        self._stop.set()
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None